@@ -3,6 +3,7 @@ from gym.envs.registration import register
 
 from .cliff_walking import *
 from .frozen_lake import *
+from .vector import VectorEnv
 
 LAKE_STEP_PROB = 0.5
 LAKE_STEP_REW = -0.1
@@ -14,7 +15,7 @@ CLIFF_FALL_REW = -100
 CLIFF_GOAL_REW = 100
 
 
-__all__ = ['RewardingFrozenLakeEnv', 'WindyCliffWalkingEnv']
+__all__ = ['RewardingFrozenLakeEnv', 'WindyCliffWalkingEnv', 'VectorEnv']
 
 register(
     id='RewardingFrozenLake4x4-v0',
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Bump when the layout or meaning of the cached arrays changes
+CACHE_VERSION = 1
+ARRAY_NAMES = ['next_states', 'probs', 'rewards', 'dones']
+
+# Directory of the on-disk MDP cache; None disables caching
+_cache_dir = None
+
+
+def set_cache_dir(cache_dir):
+    """
+    Enable the on-disk cache of built transition models (or disable it with None).
+
+    :param cache_dir: Directory holding the cached models
+    :return: None
+    """
+
+    global _cache_dir
+    _cache_dir = cache_dir
+    if cache_dir is not None and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+
+def get_cache_dir():
+    return _cache_dir
+
+
+def model_key(kind, desc, params):
+    """
+    Content address of a transition model: a hash of the environment kind, its map and every parameter that shapes
+    its transitions.
+
+    :param kind: The environment kind, e.g. 'frozen_lake'
+    :param desc: The map, a 2-D array of bytes
+    :param params: Dict of JSON serializable parameters
+    :return: Hex digest
+    """
+
+    h = hashlib.sha1()
+    h.update(json.dumps({'version': CACHE_VERSION, 'kind': kind, 'shape': list(desc.shape), 'params': params},
+                        sort_keys=True).encode('utf-8'))
+    h.update(np.ascontiguousarray(desc).tobytes())
+    return h.hexdigest()
+
+
+def load_or_build(kind, desc, params, build):
+    """
+    Load a transition model from the cache, or build it and store it there. Cached arrays are memory-mapped read-only,
+    so processes that load the same model share its pages.
+
+    :param kind: The environment kind, e.g. 'frozen_lake'
+    :param desc: The map, a 2-D array of bytes
+    :param params: Dict of JSON serializable parameters
+    :param build: Function building the (next_states, probs, rewards, dones) arrays
+    :return: The (next_states, probs, rewards, dones) arrays
+    """
+
+    if _cache_dir is None:
+        return build()
+
+    model_dir = os.path.join(_cache_dir, model_key(kind, desc, params))
+    if os.path.isdir(model_dir):
+        try:
+            return tuple(np.load(os.path.join(model_dir, name + '.npy'), mmap_mode='r') for name in ARRAY_NAMES)
+        except (IOError, ValueError) as e:
+            logger.warning('Ignoring unreadable cached MDP {}: {}'.format(model_dir, e))
+
+    arrays = build()
+
+    # Write to a private directory first and move it into place, so readers never see a partial model
+    tmp_dir = '{}.tmp-{}'.format(model_dir, os.getpid())
+    try:
+        os.makedirs(tmp_dir)
+        for name, array in zip(ARRAY_NAMES, arrays):
+            np.save(os.path.join(tmp_dir, name + '.npy'), np.ascontiguousarray(array))
+        os.rename(tmp_dir, model_dir)
+    except OSError:
+        # Another process stored the same model first (or the cache is not writable)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return arrays
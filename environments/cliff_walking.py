@@ -4,12 +4,23 @@ from gym import utils
 from gym.envs.toy_text import discrete
 from six import StringIO
 
+from . import cache
+from .transitions import TransitionTable, grid_moves
+
 
 UP = 0
 RIGHT = 1
 DOWN = 2
 LEFT = 3
 
+# (row, col) offset of each action
+MOVES = {
+    UP: (-1, 0),
+    RIGHT: (0, 1),
+    DOWN: (1, 0),
+    LEFT: (0, -1),
+}
+
 MAPS = {
     "4x12": [
              "RRRWWWVVWRRR",
@@ -46,7 +57,8 @@ class WindyCliffWalkingEnv(discrete.DiscreteEnv):
 
     metadata = {'render.modes': ['human', 'ansi']}
 
-    def __init__(self, desc = None, map_name = '4x12', wind_prob=0.1, step_rew=-1, fall_rew=-100, goal_rew=100):
+    def __init__(self, desc = None, map_name = '4x12', wind_prob=0.1, step_rew=-1, fall_rew=-100, goal_rew=100,
+                 transitions = None):
 
         self.map_name = map_name
         if desc is None and self.map_name is None:
@@ -70,37 +82,26 @@ class WindyCliffWalkingEnv(discrete.DiscreteEnv):
         winds[:, [3, 4, 5, 8]] = 1
         # Winds that move the agend down 2 positions
         winds[:, [6, 7]] = 2
+        self.winds = winds
 
         # Start Location
-        self._start_state_index = 0
-        for s in range(nS):
-            position = np.unravel_index(s, self.shape)
-            if self.desc[position] == b'S':
-                self._start_state_index = np.ravel_multi_index(position, self.shape)
+        starts = np.flatnonzero(self.desc.ravel() == b'S')
+        self._start_state_index = int(starts[-1]) if len(starts) > 0 else 0
 
         # Cliff Location
-        self._cliff = np.zeros(self.shape, dtype=np.bool)
-        for s in range(nS):
-            position = np.unravel_index(s, self.shape)
-            if self.desc[position] == b'C':
-                self._cliff[position] = True
+        self._cliff = self.desc == b'C'
 
         # Terminal States
-        self._terminal_state = np.zeros(self.shape, dtype=np.bool)
-        for s in range(nS):
-            position = np.unravel_index(s, self.shape)
-            if self.desc[position] == b'G':
-                self._terminal_state[position] = True
-
-        # Calculate transition probabilities and rewards
-        P = {}
-        for s in range(nS):
-            position = np.unravel_index(s, self.shape)
-            P[s] = {a: [] for a in range(nA)}
-            P[s][UP] = self._calculate_transition_prob(position, [-1, 0], winds)
-            P[s][RIGHT] = self._calculate_transition_prob(position, [0, 1], winds)
-            P[s][DOWN] = self._calculate_transition_prob(position, [1, 0], winds)
-            P[s][LEFT] = self._calculate_transition_prob(position, [0, -1], winds)
+        self._terminal_state = self.desc == b'G'
+
+        # Calculate transition probabilities and rewards for every state at once (unless shared with a new instance
+        # or loaded from the MDP cache)
+        if transitions is None:
+            params = {'wind_prob': wind_prob, 'step_rew': step_rew, 'fall_rew': fall_rew, 'goal_rew': goal_rew,
+                      'winds': winds.tolist()}
+            transitions = cache.load_or_build('cliff_walking', desc, params, lambda: self._calculate_transitions(winds))
+        self.transitions = transitions
+        P = TransitionTable(*self.transitions)
 
         # Calculate initial state distribution
         isd = np.zeros(nS)
@@ -108,63 +109,27 @@ class WindyCliffWalkingEnv(discrete.DiscreteEnv):
 
         super(WindyCliffWalkingEnv, self).__init__(nS, nA, P, isd)
 
-    def _limit_coordinates(self, coord):
+    def _calculate_transitions(self, winds):
         """
-        Prevent the agent from falling out of the grid world
-        :param coord:
-        :return:
+        Determine the outcomes of every action in every state: the agent either moves as intended or, with
+        probability wind_prob, is also pushed down by the wind of its current cell. Moves are clipped to the grid.
+        Moving onto a cliff sends the agent back to the start state.
+        :param winds: How far the wind pushes the agent down in each cell
+        :return: nS x nA x 2 arrays of (next_states, probs, rewards, dones)
         """
 
-        coord[0] = min(coord[0], self.shape[0] - 1)
-        coord[0] = max(coord[0], 0)
-        coord[1] = min(coord[1], self.shape[1] - 1)
-        coord[1] = max(coord[1], 0)
-        return coord
+        pushes = winds.ravel().astype(int)
+        next_states = np.stack([np.stack([grid_moves(self.shape, dr, dc), grid_moves(self.shape, dr + pushes, dc)],
+                                         axis=-1)
+                                for dr, dc in [MOVES[a] for a in range(len(MOVES))]], axis=1)
 
-    def _calculate_transition_prob(self, current, delta, winds):
-        """
-        Determine the outcome for an action. Transition Prob is always 1.0.
-        :param current: Current position on the grid as (row, col)
-        :param delta: Change in position for transition
-        :return: (1.0, new_state, reward, done)
-        """
+        dones = self._terminal_state.ravel()[next_states]
+        cliffs = self._cliff.ravel()[next_states]
+        rewards = np.where(cliffs, float(self.fall_rew), np.where(dones, float(self.goal_rew), float(self.step_rew)))
+        next_states = np.where(cliffs, self._start_state_index, next_states)
+        probs = np.broadcast_to(np.array([1 - self.wind_prob, self.wind_prob]), next_states.shape)
 
-        # Get the new position
-        new_position = np.array(current) + np.array(delta)
-        new_position = self._limit_coordinates(new_position).astype(int)
-
-        pushed_position = np.array(current) + np.array(delta) + (np.array([1, 0]) * winds[tuple(current)])
-        pushed_position = self._limit_coordinates(pushed_position).astype(int)
-
-        # Get the new state
-        new_state = np.ravel_multi_index(tuple(new_position), self.shape)
-        new_done = False
-        new_rew = self.step_rew
-        # Check if new position is a terminal state
-        if self._terminal_state[new_position[0], new_position[1]]:
-            new_rew = self.goal_rew
-            new_done = True
-        # Check if new position is a cliff position; if so, the agent is moved to the start state
-        if self._cliff[tuple(new_position)]:
-            new_rew = self.fall_rew
-            new_state = self._start_state_index
-
-        pushed_state = np.ravel_multi_index(tuple(pushed_position), self.shape)
-        pushed_done = False
-        pushed_rew = self.step_rew
-        # Check if pushed position is a terminal state
-        if self._terminal_state[pushed_position[0], pushed_position[1]]:
-            pushed_rew = self.goal_rew
-            pushed_done = True
-        # Check if pushed position is a cliff position; if so, the agent is moved to the start state
-        if self._cliff[tuple(pushed_position)]:
-            pushed_rew = self.fall_rew
-            pushed_state = self._start_state_index
-
-        return [
-            (1 - self.wind_prob, new_state, new_rew, new_done),
-            (self.wind_prob, pushed_state, pushed_rew, pushed_done),
-            ]
+        return next_states, probs, rewards, dones
 
     def render(self, mode='human'):
 
@@ -183,6 +148,13 @@ class WindyCliffWalkingEnv(discrete.DiscreteEnv):
         if mode != 'human':
             return outfile
 
+    def seed(self, seed=None):
+        # Given a numpy Generator, the environment draws from that Generator's stream
+        if isinstance(seed, np.random.Generator):
+            self.np_random = np.random.RandomState(seed.bit_generator)
+            return []
+        return super(WindyCliffWalkingEnv, self).seed(seed)
+
     def colors(self):
 
         return {
@@ -206,4 +178,5 @@ class WindyCliffWalkingEnv(discrete.DiscreteEnv):
 
     def new_instance(self):
         return WindyCliffWalkingEnv(desc=self.desc, map_name=self.map_name, wind_prob=self.wind_prob, \
-                                    step_rew=self.step_rew, fall_rew=self.fall_rew, goal_rew=self.goal_rew)
+                                    step_rew=self.step_rew, fall_rew=self.fall_rew, goal_rew=self.goal_rew,
+                                    transitions=self.transitions)
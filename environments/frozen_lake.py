@@ -4,12 +4,23 @@ from gym import utils
 from gym.envs.toy_text import discrete
 from six import StringIO
 
+from . import cache
+from .transitions import TransitionTable, grid_moves
+
 
 LEFT = 0
 DOWN = 1
 RIGHT = 2
 UP = 3
 
+# (row, col) offset of each action
+MOVES = {
+    LEFT: (0, -1),
+    DOWN: (1, 0),
+    RIGHT: (0, 1),
+    UP: (-1, 0),
+}
+
 MAPS = {
     "4x4": [
         "SFFF",
@@ -116,7 +127,7 @@ class RewardingFrozenLakeEnv(discrete.DiscreteEnv):
     metadata = {'render.modes': ['human', 'ansi']}
 
     def __init__(self, desc=None, map_name="4x4", rewarding=True, step_rew=-0.1, hole_rew=-1, goal_rew = 1, \
-                 is_slippery=True, step_prob = 0.5):
+                 is_slippery=True, step_prob = 0.5, transitions = None):
 
         if desc is None and map_name is None:
             raise ValueError('Must provide either desc or map_name')
@@ -139,60 +150,42 @@ class RewardingFrozenLakeEnv(discrete.DiscreteEnv):
         isd = np.array(desc == b'S').astype('float64').ravel()
         isd /= isd.sum()
 
-        P = {s: {a: [] for a in range(nA)} for s in range(nS)}
-
-        def to_s(row, col):
-            return row * ncol + col
-
-        def inc(row, col, a):
-
-            if a == 0:  # left
-                col = max(col - 1, 0)
-            elif a == 1:  # down
-                row = min(row + 1, nrow - 1)
-            elif a == 2:  # right
-                col = min(col + 1, ncol - 1)
-            elif a == 3:  # up
-                row = max(row - 1, 0)
-            return (row, col)
-
-        for row in range(nrow):
-            for col in range(ncol):
-                s = to_s(row, col)
-                for a in range(4):
-                    li = P[s][a]
-                    letter = desc[row, col]
-                    if is_slippery:
-                        for b in [(a - 1) % 4, a, (a + 1) % 4]:
-                            newrow, newcol = inc(row, col, b)
-                            newstate = to_s(newrow, newcol)
-                            newletter = desc[newrow, newcol]
-                            done = bytes(newletter) in b'GH'
-                            rew = self.goal_reward * float(newletter == b'G')
-                            if self.rewarding:
-                                if newletter in b'FS':
-                                    rew = self.step_reward
-                                elif newletter == b'H':
-                                    rew = self.hole_reward
-                            if b == a:
-                                li.append((self.step_prob, newstate, rew, done))
-                            else:
-                                li.append((self.slip_prob, newstate, rew, done))
-                    else:
-                        newrow, newcol = inc(row, col, a)
-                        newstate = to_s(newrow, newcol)
-                        newletter = desc[newrow, newcol]
-                        done = bytes(newletter) in b'GH'
-                        rew = self.goal_reward * float(newletter == b'G')
-                        if self.rewarding:
-                            if newletter in b'FS':
-                                rew = self.step_reward
-                            elif newletter == b'H':
-                                rew = self.hole_reward
-                        li.append((1.0, newstate, rew, done))
+        # Transition arrays are shared with new instances, loaded from the MDP cache or built
+        if transitions is None:
+            params = {'rewarding': bool(rewarding), 'step_rew': step_rew, 'hole_rew': hole_rew, 'goal_rew': goal_rew,
+                      'is_slippery': bool(is_slippery), 'step_prob': self.step_prob}
+            transitions = cache.load_or_build('frozen_lake', desc, params, self._calculate_transitions)
+        self.transitions = transitions
+        P = TransitionTable(*self.transitions)
 
         super(RewardingFrozenLakeEnv, self).__init__(nS, nA, P, isd)
 
+    def _calculate_transitions(self):
+        """
+        Determine the outcomes of every action in every state: the intended move, plus slipping to either side when
+        the lake is slippery. Moves are clipped to the lake.
+        :return: nS x nA x K arrays of (next_states, probs, rewards, dones)
+        """
+
+        nA = len(MOVES)
+        if self.is_slippery:
+            outcomes = [[(a - 1) % 4, a, (a + 1) % 4] for a in range(nA)]
+            probs = np.array([self.slip_prob, self.step_prob, self.slip_prob])
+        else:
+            outcomes = [[a] for a in range(nA)]
+            probs = np.array([1.0])
+
+        destinations = [grid_moves(self.desc.shape, *MOVES[b]) for b in range(nA)]
+        next_states = np.stack([np.stack([destinations[b] for b in bs], axis=-1) for bs in outcomes], axis=1)
+        letters = self.desc.ravel()[next_states]
+        dones = (letters == b'G') | (letters == b'H')
+        rewards = self.goal_reward * (letters == b'G').astype('float64')
+        if self.rewarding:
+            rewards[(letters == b'F') | (letters == b'S')] = self.step_reward
+            rewards[letters == b'H'] = self.hole_reward
+
+        return next_states, np.broadcast_to(probs, next_states.shape), rewards, dones
+
     def render(self, mode='human'):
 
         outfile = StringIO() if mode == 'ansi' else sys.stdout
@@ -210,6 +203,13 @@ class RewardingFrozenLakeEnv(discrete.DiscreteEnv):
         if mode != 'human':
             return outfile
 
+    def seed(self, seed=None):
+        # Given a numpy Generator, the environment draws from that Generator's stream
+        if isinstance(seed, np.random.Generator):
+            self.np_random = np.random.RandomState(seed.bit_generator)
+            return []
+        return super(RewardingFrozenLakeEnv, self).seed(seed)
+
     def colors(self):
 
         return {
@@ -232,5 +232,5 @@ class RewardingFrozenLakeEnv(discrete.DiscreteEnv):
     def new_instance(self):
         return RewardingFrozenLakeEnv(desc=self.desc, rewarding=self.rewarding, step_rew=self.step_reward, \
                                       hole_rew=self.hole_reward, goal_rew=self.goal_reward, is_slippery=self.is_slippery, \
-                                      step_prob=self.step_prob)
+                                      step_prob=self.step_prob, transitions=self.transitions)
 
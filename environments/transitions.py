@@ -0,0 +1,53 @@
+import numpy as np
+
+from collections.abc import Mapping
+
+
+def grid_moves(shape, dr, dc):
+    """
+    Destination of a move from every cell of a grid, clipped to the grid.
+
+    :param shape: The (rows, cols) shape of the grid
+    :param dr: Row offset; an int, or an array with one offset per cell (row-major)
+    :param dc: Column offset
+    :return: The flat destination state of each cell
+    """
+
+    nrow, ncol = shape
+    rows, cols = np.indices(shape).reshape(2, -1)
+    return np.clip(rows + dr, 0, nrow - 1) * ncol + np.clip(cols + dc, 0, ncol - 1)
+
+
+class TransitionTable(Mapping):
+    """
+    A discrete.DiscreteEnv transition dict backed by dense transition arrays: P[s][a] is a list of
+    (prob, next_state, reward, done) tuples. Each state's entries are only built (once) when first looked up, so
+    creating an environment from existing arrays, e.g. memory-mapped from the MDP cache, costs next to nothing.
+    """
+
+    def __init__(self, next_states, probs, rewards, dones):
+        """
+        :param next_states: nS x nA x K array of next states (K outcomes per state and action)
+        :param probs: Outcome probabilities, broadcastable to next_states
+        :param rewards: Outcome rewards, shaped like next_states
+        :param dones: Outcome done flags, shaped like next_states
+        """
+
+        self._arrays = [np.broadcast_to(x, next_states.shape) for x in (probs, next_states, rewards, dones)]
+        self._rows = {}
+
+    def __getitem__(self, s):
+        row = self._rows.get(s)
+        if row is None:
+            if not 0 <= s < len(self):
+                raise KeyError(s)
+            columns = [x[s].tolist() for x in self._arrays]
+            row = {a: list(zip(*(c[a] for c in columns))) for a in range(len(columns[0]))}
+            self._rows[s] = row
+        return row
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __len__(self):
+        return self._arrays[1].shape[0]
@@ -0,0 +1,125 @@
+import numpy as np
+
+
+class VectorEnv(object):
+    """
+    Steps many independent episodes of a discrete environment at once.
+
+    States, actions, next states, rewards and dones are all arrays (one entry per episode) and every outcome is sampled
+    from precomputed cumulative transition probabilities, so advancing N episodes is a few array operations instead of
+    N calls to env.step. Sampling consumes one uniform per episode in order, exactly like DiscreteEnv does, so a single
+    episode stepped here follows the same trajectory as the environment itself for the same seed.
+    """
+
+    def __init__(self, env, rng=None):
+        """
+        :param env: A discrete.DiscreteEnv (wrapped or unwrapped)
+        :param rng: numpy Generator (or RandomState) to sample with; defaults to the environment's own RandomState
+        """
+
+        env = env.unwrapped
+        self.nS = env.nS
+        self.nA = env.nA
+        self.rng = rng if rng is not None else env.np_random
+
+        transitions = getattr(env, 'transitions', None)
+        if transitions is None:
+            transitions = _pad_transitions(env.P, env.nS, env.nA)
+        next_states, probs, rewards, dones = transitions
+
+        self.next_states = next_states
+        self.rewards = rewards
+        self.dones = dones
+        self.cum_probs = np.cumsum(np.broadcast_to(probs, next_states.shape), axis=-1)
+        self.cum_isd = np.cumsum(np.asarray(env.isd, dtype=np.float64))
+
+    def reset(self, n):
+        """
+        Sample the initial states of n episodes.
+
+        :param n: Number of episodes
+        :return: Array of n states
+        """
+
+        return _categorical(self.cum_isd, self.rng.random(n))
+
+    def sample(self, states, actions, u):
+        """
+        Outcome of taking actions in states, given one uniform random number per episode.
+
+        :param states: Array of states
+        :param actions: Array of actions, shaped like states
+        :param u: Array of uniforms in [0, 1), shaped like states
+        :return: A tuple of arrays (next_states, rewards, dones)
+        """
+
+        # Index of the first outcome whose cumulative probability exceeds u, as gym's categorical_sample
+        i = (self.cum_probs[states, actions] > np.asarray(u)[..., np.newaxis]).argmax(axis=-1)
+        return self.next_states[states, actions, i], self.rewards[states, actions, i], self.dones[states, actions, i]
+
+    def step(self, states, actions):
+        """
+        Take one step in every episode.
+
+        :param states: Array of current states
+        :param actions: Array of actions, shaped like states
+        :return: A tuple of arrays (next_states, rewards, dones)
+        """
+
+        return self.sample(states, actions, self.rng.random(np.shape(states)))
+
+    def rollout(self, policy, n, max_steps):
+        """
+        Run n episodes of a deterministic policy at once, each until it is done or has taken max_steps steps.
+
+        :param policy: The action to take in each state, vector of length nS
+        :param n: Number of episodes
+        :param max_steps: Most steps per episode
+        :return: A tuple of arrays (total rewards, episode lengths), one entry per episode
+        """
+
+        policy = np.asarray(policy)
+        states = self.reset(n)
+        total_rewards = np.zeros(n)
+        lengths = np.zeros(n, dtype=np.int64)
+
+        # Only episodes that are still running take a step
+        running = np.arange(n)
+        for _ in range(max_steps):
+            if len(running) == 0:
+                break
+            next_states, rewards, dones = self.step(states, policy[states])
+            total_rewards[running] += rewards
+            lengths[running] += 1
+            states = next_states[~dones]
+            running = running[~dones]
+
+        return total_rewards, lengths
+
+
+def _categorical(cum_probs, u):
+    # First index whose cumulative probability exceeds u (0 if rounding left none, as gym's categorical_sample)
+    i = np.searchsorted(cum_probs, u, side='right')
+    return np.where(i < len(cum_probs), i, 0)
+
+
+def _pad_transitions(P, nS, nA):
+    """
+    Dense nS x nA x K transition arrays from a transition dict, padding actions with fewer than K outcomes with
+    impossible (zero probability) ones.
+    """
+
+    K = max(len(P[s][a]) for s in range(nS) for a in range(nA))
+    next_states = np.zeros((nS, nA, K), dtype=np.int64)
+    probs = np.zeros((nS, nA, K))
+    rewards = np.zeros((nS, nA, K))
+    dones = np.zeros((nS, nA, K), dtype=bool)
+    for s in range(nS):
+        for a in range(nA):
+            for k, (prob, next_state, reward, done) in enumerate(P[s][a]):
+                next_states[s, a, k] = next_state
+                probs[s, a, k] = prob
+                rewards[s, a, k] = reward
+                dones[s, a, k] = done
+
+    return next_states, probs, rewards, dones
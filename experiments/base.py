@@ -1,15 +1,28 @@
 import csv
+import functools
+import hashlib
+import heapq
+import json
 import logging
 import os
 import math
+import multiprocessing
+import multiprocessing.util
 import pickle
+import sys
 import time
 
 import numpy as np
 
 from abc import ABC, abstractmethod
-
-from .plotting import plot_policy_map, plot_value_map
+from scipy import stats as st
+
+from .plotting import MapPlotter
+from .checkpoints import CHECKPOINT_INTERVAL, get_checkpoint_dir, resuming, save_checkpoint, load_checkpoint, \
+    remove_checkpoint
+from .results import get_results_store, params_key, ResultsStore
+from .run_cache import get_run_cache, mdp_hash, code_version
+from .writer import BackgroundWriter
 import solvers
 
 
@@ -20,6 +33,12 @@ logger = logging.getLogger(__name__)
 OUTPUT_DIR = 'output'
 MAX_STEPS = 2000
 NUM_TRIALS = 100
+SCORING = 'rollouts'
+TRIAL_TOLERANCE = None
+MIN_TRIALS = 30
+TRIAL_CONFIDENCE = 0.95
+MAX_SNAPSHOTS = 20
+ASYNC_OUTPUT = True
 
 
 if not os.path.exists(os.path.join(os.getcwd(), OUTPUT_DIR)):
@@ -27,8 +46,55 @@ if not os.path.exists(os.path.join(os.getcwd(), OUTPUT_DIR)):
 if not os.path.exists(os.path.join(os.path.join(os.getcwd(), OUTPUT_DIR), 'images')):
     os.makedirs(os.path.join(os.path.join(os.getcwd(), OUTPUT_DIR), 'images'))
 
+GRID_HEADER = "params,time,steps,reward_mean,reward_median,reward_min,reward_max,reward_std\n"
+
+# The experiment whose grid a pool worker process runs (set once per worker)
+_grid_experiment = None
+
+
+def _init_grid_worker(experiment):
+    global _grid_experiment
+    _grid_experiment = experiment
+
+
+def _run_grid_chunk(task):
+    index, chunk = task
+    return _grid_experiment.run_worker_chunk(index, chunk)
+
+
+def _call_grid_experiment(task):
+    method_name, args = task
+    return getattr(_grid_experiment, method_name)(*args)
+
+
+def _completed_points(grid_file_name):
+    """
+    The keys (see params_key) of the grid points a grid file already has. A last row left half written by an
+    interrupted run is cut off the file.
+    """
+
+    if not os.path.exists(grid_file_name):
+        return set()
+
+    with open(grid_file_name, 'rb+') as f:
+        content = f.read()
+        end = content.rfind(b'\n') + 1
+        if end < len(content):
+            f.truncate(end)
+
+    with open(grid_file_name, newline='') as f:
+        rows = list(csv.reader(f))
+    return set(params_key(json.loads(row[0])) for row in rows[1:] if len(row) == len(GRID_HEADER.split(',')))
+
 
 class EvaluationStats(object):
+    """
+    Running stats of policy evaluation trial rewards. Every add updates them in O(log n): mean and variance with
+    Welford's method, min and max directly, and the median from two heaps (a max heap of the lower half, stored
+    negated, and a min heap of the upper half). Welford's mean and standard deviation can differ from np.mean and
+    np.std over the same rewards in the last bit or so (numpy sums pairwise), so CSVs written with them are not
+    byte for byte those of recomputing the stats over every reward, only equal to within rounding.
+    """
 
     def __init__(self):
         self.rewards = list()
@@ -39,19 +105,34 @@ class EvaluationStats(object):
         self.reward_max = 0
         self.reward_min = 0
         self.runs = 0
+        self._m2 = 0.0
+        self._lower = list()
+        self._upper = list()
 
     def add(self, reward):
         self.rewards.append(reward)
-        self.compute()
-
-    def compute(self):
-        reward_array = np.array(self.rewards)
         self.runs = len(self.rewards)
-        self.reward_mean = np.mean(reward_array)
-        self.reward_median = np.median(reward_array)
-        self.reward_std = np.std(reward_array)
-        self.reward_max = np.max(reward_array)
-        self.reward_min = np.min(reward_array)
+
+        delta = reward - self.reward_mean
+        self.reward_mean += delta / self.runs
+        self._m2 += delta * (reward - self.reward_mean)
+        self.reward_std = math.sqrt(self._m2 / self.runs)
+        self.reward_max = reward if self.runs == 1 else max(self.reward_max, reward)
+        self.reward_min = reward if self.runs == 1 else min(self.reward_min, reward)
+
+        if self._lower and reward > -self._lower[0]:
+            heapq.heappush(self._upper, reward)
+        else:
+            heapq.heappush(self._lower, -reward)
+        if len(self._lower) > len(self._upper) + 1:
+            heapq.heappush(self._upper, -heapq.heappop(self._lower))
+        elif len(self._upper) > len(self._lower):
+            heapq.heappush(self._lower, -heapq.heappop(self._upper))
+        if len(self._lower) > len(self._upper):
+            self.reward_median = -self._lower[0]
+        else:
+            self.reward_median = (-self._lower[0] + self._upper[0]) / 2.0
+
         self.stat_history.append((
             self.reward_mean,
             self.reward_median,
@@ -60,8 +141,12 @@ class EvaluationStats(object):
             self.reward_min
         ))
 
+    def columns(self):
+        means, medians, stds, maxes, mins = zip(*self.stat_history) if self.stat_history else ([],) * 5
+        return [('step', range(len(self.rewards))), ('reward', self.rewards), ('mean', means), ('median', medians),
+                ('std', stds), ('max', maxes), ('min', mins)]
+
     def to_csv(self, file_name):
-        self.compute()
         means, medians, stds, maxes, mins = zip(*self.stat_history)
         with open(file_name, 'w') as f:
             f.write("step,reward,mean,median,std,max,min\n")
@@ -79,11 +164,61 @@ class EvaluationStats(object):
         )
 
 
+class ExactEvaluationStats(object):
+    """
+    Stats of a policy evaluated exactly (see solvers.exact_policy_evaluation) rather than by running trials. Stands in
+    for EvaluationStats: the mean and std of the per trial mean reward are exact, and there are no trials to take the
+    median, min or max of.
+    """
+
+    def __init__(self, evaluation):
+        self.evaluation = evaluation
+        self.rewards = list()
+        self.reward_mean = evaluation.reward_mean
+        self.reward_median = np.nan
+        self.reward_std = evaluation.reward_std
+        self.reward_max = np.nan
+        self.reward_min = np.nan
+        self.runs = 0
+
+    def columns(self):
+        kinds = sorted(self.evaluation.absorption.keys())
+        return [('expected_return', [self.evaluation.expected_return]),
+                ('expected_length', [self.evaluation.expected_length]), ('mean', [self.reward_mean]),
+                ('std', [self.reward_std])] + [('p_{}'.format(kind), [self.evaluation.absorption[kind]])
+                                               for kind in kinds]
+
+    def to_csv(self, file_name):
+        kinds = sorted(self.evaluation.absorption.keys())
+        with open(file_name, 'w') as f:
+            f.write(','.join(['expected_return', 'expected_length', 'mean', 'std'] +
+                             ['p_{}'.format(kind) for kind in kinds]) + '\n')
+            writer = csv.writer(f, delimiter=',')
+            writer.writerow([self.evaluation.expected_return, self.evaluation.expected_length, self.reward_mean,
+                             self.reward_std] + [self.evaluation.absorption[kind] for kind in kinds])
+
+    def __str__(self):
+        return 'reward_mean: {}, reward_std: {}, {}'.format(self.reward_mean, self.reward_std, self.evaluation)
+
+
 class ExperimentStats(object):
+    """
+    Per step stats of a solver run. Policies and values are only kept as snapshots: every snapshot_step_size-th step
+    (or, without one, about MAX_SNAPSHOTS evenly spaced steps, thinned by doubling the stride as the run grows) plus
+    the last step, with policies stored as vectors of actions. With spill, snapshots are handed off (e.g. saved) as
+    they arrive instead of being kept, so memory stays bounded however long the run.
+    """
+
+    def __init__(self, snapshot_step_size=None, spill=None):
+        """
+        :param snapshot_step_size: Keep the policy and value of every step that is a multiple of this
+        :param spill: If not none, function taking the (step, actions, value) of every snapshot as it arrives, instead
+            of keeping it; needs snapshot_step_size
+        """
+
+        if spill is not None and snapshot_step_size is None:
+            raise ValueError('Spilling snapshots needs a snapshot step size')
 
-    def __init__(self):
-        self.policies = list()
-        self.vs = list()
         self.steps = list()
         self.step_times = list()
         self.rewards = list()
@@ -91,16 +226,94 @@ class ExperimentStats(object):
         self.converged_values = list()
         self.elapsed_time = 0
         self.optimal_policy = None
+        self.last_policy = None
+        self.last_v = None
+        self.snapshots = dict()
+        self.spilled = list()
+
+        self._snapshot_step_size = snapshot_step_size
+        self._stride = 1
+        self._spill = spill
+
+    def __getstate__(self):
+        # The spill function is not part of a checkpoint; it is handed back on resuming
+        state = self.__dict__.copy()
+        state['_spill'] = None
+        return state
 
     def add(self, policy, v, step, step_time, reward, delta, converged):
-        self.policies.append(policy)
-        self.vs.append(v)
+        """
+        Add a step's stats. The policy and value may be views of arrays the solver goes on updating (see
+        QLearningSolver.step); only the snapshots kept are copied, and the last ones are as of the last step. They may
+        be None on steps that are neither kept nor the last (see RecordedQLearningSolver).
+        """
+
+        i = len(self.steps)
+        self.last_policy = policy
+        self.last_v = v
+        if self._snapshot_step_size is not None:
+            if i % self._snapshot_step_size == 0:
+                self._snapshot(i, policy, v)
+        elif i % self._stride == 0:
+            self._snapshot(i, policy, v)
+            if len(self.snapshots) > 2 * MAX_SNAPSHOTS:
+                self._stride *= 2
+                self.snapshots = {j: snapshot for j, snapshot in self.snapshots.items() if j % self._stride == 0}
+
         self.steps.append(step)
         self.step_times.append(step_time)
         self.rewards.append(reward)
         self.deltas.append(delta)
         self.converged_values.append(converged)
 
+    def _snapshot(self, i, policy, v):
+        actions = np.argmax(policy, axis=1).astype(np.min_scalar_type(policy.shape[1] - 1))
+        v = np.array(v)
+        if self._spill is None:
+            self.snapshots[i] = (actions, v)
+            return
+
+        self._spill(i, actions, v)
+        self.spilled.append(i)
+
+    @staticmethod
+    def pickle_snapshot(file_name, actions, v, map_shape):
+        # (actions are pickled as the argmax of the full policy would be)
+        with open(file_name, 'wb') as f:
+            pickle.dump({'policy': np.reshape(actions.astype(np.intp), map_shape), 'v': v.reshape(map_shape)}, f)
+
+    def last_snapshot(self):
+        """
+        The last step's policy, as actions, and value.
+        """
+
+        return np.argmax(self.last_policy, axis=1), self.last_v
+
+    def snapshots_to_save(self, step_size=1):
+        """
+        The snapshots to save: those on every step_size-th step (with step_size 1, about MAX_SNAPSHOTS of them) and
+        the last one.
+
+        :param step_size: Save every step_size-th step's snapshot
+        :return: List of (step or 'Last', actions, value) tuples
+        """
+
+        l = len(self.steps)
+        if step_size == 1 and l > MAX_SNAPSHOTS:
+            if self._snapshot_step_size is None and self._stride > 1:
+                # (thinned already; what is left is evenly spaced)
+                step_size = self._stride
+            else:
+                step_size = math.floor(l/float(MAX_SNAPSHOTS))
+
+        saved = [(i, actions, v) for i, (actions, v) in sorted(self.snapshots.items())
+                 if i % step_size == 0 and i != l-1]
+        return saved + [('Last',) + self.last_snapshot()]
+
+    def columns(self):
+        return [('steps', self.steps), ('time', self.step_times), ('reward', self.rewards), ('delta', self.deltas),
+                ('converged', self.converged_values)]
+
     def to_csv(self, file_name):
         with open(file_name, 'w') as f:
             f.write("steps,time,reward,delta,converged\n")
@@ -109,70 +322,48 @@ class ExperimentStats(object):
 
     def pickle_results(self, file_name_base, map_shape, step_size=1, only_last=False):
         if only_last:
-            policy = np.reshape(np.argmax(self.policies[-1], axis=1), map_shape)
-            v = self.vs[-1].reshape(map_shape)
-            file_name = file_name_base.format('Last')
-            with open(file_name, 'wb') as f:
-                pickle.dump({'policy': policy, 'v': v}, f)
+            snapshots = [('Last',) + self.last_snapshot()]
         else:
-            l = len(self.policies)
-            if step_size == 1 and l > 20:
-                step_size = math.floor(l/20.0)
-            for i, policy in enumerate(self.policies):
-                if i % step_size == 0 or i == l-1:
-                    v = self.vs[i].reshape(map_shape)
-                    file_name = file_name_base.format(i)
-                    if i == l-1:
-                        file_name = file_name_base.format('Last')
-                    with open(file_name, 'wb') as f:
-                        pickle.dump({'policy': np.reshape(np.argmax(policy, axis=1), map_shape), 'v': v}, f)
+            snapshots = self.snapshots_to_save(step_size)
+
+        # The last step's spilled snapshot is saved as 'Last' instead
+        last = len(self.steps) - 1
+        if last in self.spilled and os.path.exists(file_name_base.format(last)):
+            os.remove(file_name_base.format(last))
+
+        for i, actions, v in snapshots:
+            self.pickle_snapshot(file_name_base.format(i), actions, v, map_shape)
 
     def plot_policies_on_map(self, file_name_base, map_desc, color_map, direction_map, experiment, step_preamble,
                              details, step_size=1, only_last=False):
         if only_last:
-            policy = np.reshape(np.argmax(self.policies[-1], axis=1), map_desc.shape)
-            v = self.vs[-1].reshape(map_desc.shape)
-
-            policy_file_name = file_name_base.format('Policy', 'Last')
-            value_file_name = file_name_base.format('Value', 'Last')
-            title = '{}: {} - {} {}'.format(details.env_readable_name, experiment, 'Last', step_preamble)
-
-            p = plot_policy_map(title, policy, map_desc, color_map, direction_map)
-            p.savefig(policy_file_name, format='png', dpi=150)
-            p.close()
-
-            p = plot_value_map(title, v, map_desc, color_map)
-            p.savefig(value_file_name, format='png', dpi=150)
-            p.close()
+            snapshots = [('Last',) + self.last_snapshot()]
         else:
-            l = len(self.policies)
-            if step_size == 1 and l > 20:
-                step_size = math.floor(l/20.0)
-            for i, policy in enumerate(self.policies):
-                if i % step_size == 0 or i == l-1:
-                    policy = np.reshape(np.argmax(policy, axis=1), map_desc.shape)
-                    v = self.vs[i].reshape(map_desc.shape)
-
-                    file_name = file_name_base.format('Policy', i)
-                    value_file_name = file_name_base.format('Value', i)
-                    if i == l-1:
-                        file_name = file_name_base.format('Policy', 'Last')
-                        value_file_name = file_name_base.format('Value', 'Last')
-
-                    title = '{}: {} - {} {}'.format(details.env_readable_name, experiment, step_preamble, i)
-
-                    p = plot_policy_map(title, policy, map_desc, color_map, direction_map)
-                    p.savefig(file_name, format='png', dpi=150)
-                    p.close()
-
-                    p = plot_value_map(title, v, map_desc, color_map)
-                    p.savefig(value_file_name, format='png', dpi=150)
-                    p.close()
+            snapshots = self.snapshots_to_save(step_size)
+
+        # Images of unchanged snapshots (same arrays and title) are kept as they are
+        plotter = MapPlotter(map_desc, color_map, direction_map)
+        try:
+            for i, actions, v in snapshots:
+                policy = np.reshape(actions, map_desc.shape)
+                v = v.reshape(map_desc.shape)
+
+                file_name = file_name_base.format('Policy', i)
+                value_file_name = file_name_base.format('Value', i)
+                if only_last:
+                    title = '{}: {} - {} {}'.format(details.env_readable_name, experiment, 'Last', step_preamble)
+                else:
+                    step = len(self.steps) - 1 if i == 'Last' else i
+                    title = '{}: {} - {} {}'.format(details.env_readable_name, experiment, step_preamble, step)
+
+                plotter.save_policy(file_name, title, policy)
+                plotter.save_value(value_file_name, title, v)
+        finally:
+            plotter.close()
 
     def __str__(self):
-        return 'policies: {}, vs: {}, steps: {}, step_times: {}, deltas: {}, converged_values: {}'.format(
-            self.policies,
-            self.vs,
+        return 'snapshots: {}, steps: {}, step_times: {}, deltas: {}, converged_values: {}'.format(
+            self.snapshots,
             self.steps,
             self.step_times,
             self.deltas,
@@ -192,10 +383,44 @@ class ExperimentDetails(object):
 
 class BaseExperiment(ABC):
 
-    def __init__(self, details, verbose=False, max_steps = MAX_STEPS):
+    # The problem's name in the results store
+    PROBLEM = None
+
+    # Attributes besides a grid point's params that shape its results (see run_key)
+    SETTINGS = ('_max_steps', '_scoring', '_trial_tolerance', '_min_trials')
+
+    def __init__(self, details, verbose=False, max_steps = MAX_STEPS, scoring = SCORING,
+                 trial_tolerance = TRIAL_TOLERANCE, min_trials = MIN_TRIALS):
+        """
+        :param scoring: How the optimal policy is scored: 'rollouts' runs it num_trials times, 'exact' evaluates it
+            as an absorbing Markov chain (no sampling noise; median, min and max are then NaN)
+        :param trial_tolerance: If not none, rollouts stop early once the TRIAL_CONFIDENCE confidence interval of the
+            mean reward is narrower than this (after at least min_trials and at most num_trials trials)
+        :param min_trials: The fewest trials to run when stopping early
+        """
+
+        if scoring not in ('rollouts', 'exact'):
+            raise ValueError('Unknown policy scoring: {}'.format(scoring))
+
         self._details = details
         self._verbose = verbose
         self._max_steps = max_steps
+        self._scoring = scoring
+        self._results = get_results_store()
+        self._checkpoint_dir = get_checkpoint_dir()
+        self._run_cache = get_run_cache()
+        self._resume = resuming()
+        self._writer = None
+        self._writer_pid = None
+        self._trial_tolerance = trial_tolerance
+        self._min_trials = min_trials
+
+    def __getstate__(self):
+        # Every process has its own output writer
+        state = self.__dict__.copy()
+        state['_writer'] = None
+        state['_writer_pid'] = None
+        return state
 
     @abstractmethod
     def perform(self):
@@ -211,33 +436,410 @@ class BaseExperiment(ABC):
         if self._verbose:
             logger.info(msg.format(*args))
 
-    def run_solver_and_collect(self, solver, convergence_check_fn):
-        stats = ExperimentStats()
+    def grid_workers(self, num_tasks):
+        """
+        Number of processes to run a grid of num_tasks tasks with: details.threads, or one per CPU if it is not positive.
+        """
+
+        threads = self._details.threads
+        if threads is None or threads < 1:
+            threads = multiprocessing.cpu_count()
+        return max(1, min(threads, num_tasks))
+
+    def run_grid(self, grid_file_name, chunks):
+        """
+        Run the points of a parameter grid, chunk by chunk, and write their rows to the grid file. Chunks run in a pool
+        of worker processes when more than one worker is available; either way the rows are written in chunk order as
+        results come in, so the grid file is the same whatever the number of workers (see task_rngs). With a results
+        store, the rows are added to it too, as one run. Every grid point's output has been written when this returns.
+
+        When resuming, the points the grid file already has are skipped and the rest are added to it (and to the
+        store's latest run), so an interrupted grid carries on where it stopped.
+
+        :param grid_file_name: The grid file
+        :param chunks: List of lists of (run number, params) grid points
+        :return: None
+        """
+
+        completed = _completed_points(grid_file_name) if self._resume else set()
+        run = None
+        if completed:
+            logger.info('Resuming {}: skipping {} completed grid points'.format(grid_file_name, len(completed)))
+            chunks = [[(runs, params) for runs, params in chunk if params_key(params) not in completed]
+                      for chunk in chunks]
+            chunks = [chunk for chunk in chunks if chunk]
+            if self._results is not None:
+                run = self._results.latest_run(self.PROBLEM, self._details.env_name)
+        else:
+            with open(grid_file_name, 'w') as f:
+                f.write(GRID_HEADER)
+        if run is None:
+            run = ResultsStore.new_run()
+
+        tasks = list(enumerate(chunks))
+        workers = self.grid_workers(len(tasks))
+        if workers == 1:
+            self._write_grid_rows(grid_file_name, run, (self.run_grid_chunk(index, chunk) for index, chunk in tasks))
+            self.flush_output()
+            return
+
+        pool = multiprocessing.Pool(workers, initializer=_init_grid_worker, initargs=(self,))
+        try:
+            self._write_grid_rows(grid_file_name, run, pool.imap(_run_grid_chunk, tasks))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        self.flush_output()
+
+    def map_points(self, method_name, tasks):
+        """
+        Call one of the experiment's methods with each of a list of argument tuples, in a pool of worker processes
+        when more than one worker is available (see grid_workers). Unlike run_grid, nothing is written.
+
+        :param method_name: Name of the method
+        :param tasks: List of argument tuples
+        :return: List of the calls' results, in order
+        """
+
+        workers = self.grid_workers(len(tasks))
+        if workers == 1:
+            return [getattr(self, method_name)(*args) for args in tasks]
+
+        pool = multiprocessing.Pool(workers, initializer=_init_grid_worker, initargs=(self,))
+        try:
+            results = pool.map(_call_grid_experiment, [(method_name, args) for args in tasks], chunksize=1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return results
+
+    def run_grid_chunk(self, index, chunk):
+        """
+        Run a chunk of grid points.
+
+        :param index: The chunk's position in the grid
+        :param chunk: List of (run number, params) grid points
+        :return: The chunk's grid rows (see grid_row)
+        """
+
+        return [self.run_grid_point(runs, params) for runs, params in chunk]
+
+    def run_worker_chunk(self, index, chunk):
+        rows = self.run_grid_chunk(index, chunk)
+
+        # With checkpoints, a point only gets into the grid file (and counts as done when resuming) once all its
+        # output has been written
+        if self._checkpoint_dir is not None:
+            self.flush_output()
+        return rows
+
+    @abstractmethod
+    def run_grid_point(self, runs, params):
+        """
+        Run a single grid point, writing its output files (named after its parameters, so concurrent points never
+        share a file).
+
+        :param runs: The point's run number, for logging
+        :param params: Dict of the point's parameters
+        :return: Its grid row (see grid_row)
+        """
+
+        pass
+
+    def task_rngs(self, params, n=2):
+        """
+        Independent random streams for a grid point, spawned from a SeedSequence of the run seed and the point's
+        parameters only, so the point sees the same random numbers whichever process runs it, in whatever order or
+        batch. np.random and the environment (still used by the compat Q-learning kernel) are reseeded from it too.
+
+        :param params: Dict of the point's parameters
+        :param n: Number of streams
+        :return: List of n numpy Generators
+        """
+
+        key = self._point_hash(params).digest()
+        seed = self._details.seed if self._details.seed is not None else np.random.SeedSequence().entropy
+        seed_sequence = np.random.SeedSequence([seed] + np.frombuffer(key[:16], dtype=np.uint32).tolist())
+
+        np.random.seed(seed_sequence.generate_state(1)[0])
+        self._details.env.seed(int(seed_sequence.generate_state(2)[1]))
+        return [np.random.default_rng(child) for child in seed_sequence.spawn(n)]
+
+    def _point_hash(self, params):
+        return hashlib.sha1(json.dumps({'experiment': type(self).__name__, 'env': self._details.env_name,
+                                        'params': params}, sort_keys=True).encode('utf-8'))
+
+    def checkpoint_file(self, params):
+        """
+        The file a grid point's running solver is checkpointed to.
+        """
+
+        return os.path.join(self._checkpoint_dir, '{}_{}.pkl'.format(self._point_hash(params).hexdigest(),
+                                                                     self._details.seed))
+
+    def run_checkpointed(self, params, run):
+        """
+        Call a run that checkpoints itself (e.g. BatchedQLearningSolver.run) as run(state, checkpoint,
+        checkpoint_interval), checkpointing it as the grid point(s) of params: state is what an interrupted run saved
+        when resuming (or None), checkpoint a function saving the run's state (or None without checkpoints).
+
+        :param params: The params to name the checkpoint after (see checkpoint_file)
+        :param run: The run
+        :return: What the run returns
+        """
+
+        if self._checkpoint_dir is None:
+            return run(None, None, None)
+
+        checkpoint_file = self.checkpoint_file(params)
+        state = load_checkpoint(checkpoint_file) if self._resume else None
+        if state is not None:
+            logger.info('Resuming {} from its checkpoint'.format(params))
+        result = run(state, functools.partial(save_checkpoint, checkpoint_file), CHECKPOINT_INTERVAL)
+        remove_checkpoint(checkpoint_file)
+        return result
+
+    def run_key(self, params):
+        """
+        Content address of a grid point's results: a hash of the environment's dynamics (map, rewards, step/wind
+        probabilities), the experiment and so its solver, the point's params, the experiment's SETTINGS, the seed and
+        the code version.
+        """
+
+        return hashlib.sha1(json.dumps({
+            'experiment': type(self).__name__,
+            'mdp': mdp_hash(solvers.compile_mdp(self._details.env)),
+            'params': params,
+            'settings': {name: getattr(self, name) for name in self.SETTINGS},
+            'seed': self._details.seed,
+            'code': code_version((__file__, sys.modules[type(self).__module__].__file__)),
+        }, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def cached_results(self, params):
+        """
+        A grid point's results from the run cache, or None. Unseeded runs are not reproducible, so they are never
+        reused.
+
+        :return: The dict of results the point was cached with (see cache_results)
+        """
+
+        if self._run_cache is None or self._details.seed is None:
+            return None
+        results = self._run_cache.get(self.run_key(params))
+        if results is not None:
+            logger.info('Reusing cached results of {} {}'.format(self.PROBLEM, params))
+        return results
+
+    def cache_results(self, params, results):
+        """
+        Cache a grid point's results (a dict of its stats) for later runs with the same inputs.
+        """
+
+        if self._run_cache is not None and self._details.seed is not None:
+            self._run_cache.put(self.run_key(params), results)
+
+    @staticmethod
+    def grid_row(params, elapsed, optimal_policy_stats):
+        """
+        A grid point's row: (params, time, steps, reward_mean, reward_median, reward_min, reward_max, reward_std).
+        """
+
+        return (
+            params,
+            elapsed,
+            len(optimal_policy_stats.rewards),
+            optimal_policy_stats.reward_mean,
+            optimal_policy_stats.reward_median,
+            optimal_policy_stats.reward_min,
+            optimal_policy_stats.reward_max,
+            optimal_policy_stats.reward_std,
+        )
+
+    @staticmethod
+    def format_grid_row(row):
+        return '"{}",{},{},{},{},{},{},{}\n'.format(json.dumps(row[0]).replace('"', '""'), *row[1:])
+
+    def _write_grid_rows(self, grid_file_name, run, results):
+        for rows in results:
+            self.output(self._append_grid_rows, grid_file_name, run, rows)
+
+    def _append_grid_rows(self, grid_file_name, run, rows):
+        # The grid file goes last: it is the record of completed points when resuming
+        if self._results is not None:
+            self._results.add_points(run, self.PROBLEM, self._details.env_name, rows)
+        with open(grid_file_name, 'a') as f:
+            f.writelines(self.format_grid_row(row) for row in rows)
+
+    def output(self, fn, *args, **kwargs):
+        """
+        Run an output side effect, fn(*args, **kwargs): with ASYNC_OUTPUT, on this process's background writer (in
+        order, blocking while too many writes are pending), else right away. The arguments must not change afterwards.
+        """
+
+        if not ASYNC_OUTPUT:
+            fn(*args, **kwargs)
+            return
+
+        if self._writer is None or self._writer_pid != os.getpid():
+            self._writer = BackgroundWriter()
+            self._writer_pid = os.getpid()
+            if multiprocessing.current_process().name != 'MainProcess':
+                # A pool worker finishes its writes when it exits (the pool is closed and joined by run_grid)
+                multiprocessing.util.Finalize(self._writer, self._writer.close, exitpriority=10)
+        self._writer.submit(fn, *args, **kwargs)
+
+    def flush_output(self):
+        """
+        Wait for every output side effect of this process to finish.
+        """
+
+        if self._writer is not None and self._writer_pid == os.getpid():
+            self._writer.flush()
+
+    def save_series(self, params, name, stats, file_name):
+        """
+        Save one of a grid point's series to the results store, or to its CSV file if there is no store.
+
+        :param params: Dict of the point's parameters
+        :param name: The series: 'steps', 'optimal' or 'episode'
+        :param stats: The stats (with columns and to_csv)
+        :param file_name: The CSV file
+        :return: None
+        """
+
+        if self._results is None:
+            self.output(stats.to_csv, file_name)
+        else:
+            self.output(self._results.add_series, self.PROBLEM, self._details.env_name, params, name, stats.columns())
+
+    def save_snapshot(self, params, file_name_base, step, actions, v, map_shape):
+        """
+        Save a grid point's policy/value snapshot to the results store, or to its pickle file if there is no store.
+        """
+
+        if self._results is None:
+            self.output(ExperimentStats.pickle_snapshot, file_name_base.format(step), actions, v, map_shape)
+        else:
+            self.output(self._results.add_snapshot, self.PROBLEM, self._details.env_name, params, step,
+                        np.reshape(actions.astype(np.intp), map_shape), v.reshape(map_shape))
+
+    def save_snapshots(self, params, stats, file_name_base, map_shape, step_size=1, only_last=False):
+        """
+        Save a grid point's snapshots (see ExperimentStats.pickle_results) to the results store, or to their pickle
+        files if there is no store.
+        """
+
+        if self._results is None:
+            self.output(stats.pickle_results, file_name_base, map_shape, step_size=step_size, only_last=only_last)
+            return
+
+        snapshots = [('Last',) + stats.last_snapshot()] if only_last else stats.snapshots_to_save(step_size)
+        for step, actions, v in snapshots:
+            self.save_snapshot(params, file_name_base, step, actions, v, map_shape)
+
+    def run_solver_and_collect(self, solver, convergence_check_fn, snapshot_step_size=None, spill=None,
+                               checkpoint=None):
+        """
+        Step the solver until it converges (or max_steps), collecting its stats.
+
+        :param snapshot_step_size: Keep the policy and value of every step that is a multiple of this (see
+            ExperimentStats)
+        :param spill: If not none, function taking the (step, actions, value) of every snapshot as it arrives,
+            instead of keeping it
+        :param checkpoint: If not none, the grid point's params: with a checkpoint directory, the solver's state and
+            stats are then saved every CHECKPOINT_INTERVAL seconds, and when resuming, a run that was cut short carries
+            on from its last checkpoint
+        :return: The ExperimentStats
+        """
+
+        stats = ExperimentStats(snapshot_step_size, spill)
 
         t = time.clock()
         step_count = 0
         optimal_policy = None
         best_reward = float('-inf')
 
+        checkpoint_file = None
+        if checkpoint is not None and self._checkpoint_dir is not None and solver.STATE:
+            checkpoint_file = self.checkpoint_file(checkpoint)
+            saved = load_checkpoint(checkpoint_file) if self._resume else None
+            if saved is not None:
+                solver.set_state(saved['solver'])
+                stats, step_count, optimal_policy, best_reward = saved['stats'], saved['step_count'], \
+                    saved['optimal_policy'], saved['best_reward']
+                stats._spill = spill
+                t -= saved['elapsed_time']
+                logger.info('Resuming {} from step {}'.format(checkpoint, step_count))
+        last_checkpoint = time.time()
+
+        delta, converged = (stats.deltas[-1], stats.converged_values[-1]) if stats.steps else (None, None)
         while not convergence_check_fn(solver, step_count) and step_count < self._max_steps:
             policy, v, steps, step_time, reward, delta, converged = solver.step()
             if reward > best_reward:
                 best_reward = reward
-                optimal_policy = policy
+                optimal_policy = np.array(policy) if policy is not None else optimal_policy
 
             stats.add(policy, v, steps, step_time, reward, delta, converged)
             step_count += 1
+
+            if checkpoint_file is not None and time.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                # Snapshots spilled so far are written first, so a resumed run has every one of them
+                self.flush_output()
+                save_checkpoint(checkpoint_file, {
+                    'solver': solver.get_state(),
+                    'stats': stats,
+                    'step_count': step_count,
+                    'optimal_policy': optimal_policy,
+                    'best_reward': best_reward,
+                    'elapsed_time': time.clock() - t,
+                })
+                last_checkpoint = time.time()
         self.log('Steps: {} delta: {} converged: {}'.format(step_count, delta, converged))
 
+        if checkpoint_file is not None:
+            remove_checkpoint(checkpoint_file)
+
         stats.elapsed_time = time.clock() - t
-        stats.optimal_policy = stats.policies[-1]  # optimal_policy
+        stats.optimal_policy = stats.last_policy  # optimal_policy
         return stats
 
-    def run_policy_and_collect(self, solver, policy, num_trials=NUM_TRIALS):
+    @staticmethod
+    def confidence_interval_width(rewards, confidence=TRIAL_CONFIDENCE):
+        """
+        Width of the (normal approximation) confidence interval of the mean of the given rewards.
+        """
+
+        n = len(rewards)
+        if n < 2:
+            return float('inf')
+        return 2 * st.norm.ppf(0.5 + confidence / 2.0) * np.std(rewards, ddof=1) / math.sqrt(n)
+
+    def run_policy_and_collect(self, solver, policy, num_trials=NUM_TRIALS, rng=None):
+        if self._scoring == 'exact':
+            return ExactEvaluationStats(solver.evaluate_policy_exactly(policy, self._max_steps))
+
         stats = EvaluationStats()
-        for i in range(num_trials):
-            stats.add(np.mean(solver.run_policy(policy, self._max_steps)))
-        stats.compute()
+        if self._trial_tolerance is None:
+            for reward in solver.run_policies(policy, num_trials, self._max_steps, rng=rng):
+                stats.add(reward)
+            return stats
+
+        # Run trials in doubling batches until the mean is known well enough; the number of trials used ends up in
+        # the stats (and the grid file's steps column)
+        batch = min(self._min_trials, num_trials)
+        while batch > 0:
+            for reward in solver.run_policies(policy, batch, self._max_steps, rng=rng):
+                stats.add(reward)
+            if self.confidence_interval_width(stats.rewards) < self._trial_tolerance:
+                break
+            batch = min(len(stats.rewards), num_trials - len(stats.rewards))
+        self.log('Stopped after {} trials'.format(len(stats.rewards)))
 
         return stats
 
@@ -0,0 +1,72 @@
+import logging
+import os
+import pickle
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Seconds between checkpoints of a running solver
+CHECKPOINT_INTERVAL = 600
+
+# Directory of running solvers' checkpoints; None disables checkpointing
+_checkpoint_dir = None
+
+# Whether experiments pick up where an earlier, interrupted run of the same command stopped
+_resume = False
+
+
+def set_checkpoint_dir(checkpoint_dir, resume=False):
+    """
+    Checkpoint running solvers to a directory (or stop checkpointing with None).
+
+    :param checkpoint_dir: Directory holding the checkpoints
+    :param resume: If true, experiments skip the grid points their grid files already have and resume solvers from
+        their checkpoints, instead of starting over
+    :return: None
+    """
+
+    global _checkpoint_dir, _resume
+    _checkpoint_dir = checkpoint_dir
+    _resume = resume
+    if checkpoint_dir is not None and not os.path.exists(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+
+def get_checkpoint_dir():
+    return _checkpoint_dir
+
+
+def resuming():
+    return _resume
+
+
+def save_checkpoint(file_name, state):
+    """
+    Pickle a checkpoint. The file is replaced in one step, so an interrupted save leaves the previous checkpoint.
+    """
+
+    temp_file_name = '{}.{}.tmp'.format(file_name, os.getpid())
+    with open(temp_file_name, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file_name, file_name)
+
+
+def load_checkpoint(file_name):
+    """
+    The checkpoint pickled in a file, or None if there is none (or it cannot be read).
+    """
+
+    if not os.path.exists(file_name):
+        return None
+    try:
+        with open(file_name, 'rb') as f:
+            return pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+        logger.warning('Ignoring unreadable checkpoint {}: {}'.format(file_name, e))
+        return None
+
+
+def remove_checkpoint(file_name):
+    if os.path.exists(file_name):
+        os.remove(file_name)
@@ -1,11 +1,15 @@
 import glob
+import hashlib
+import io
 import json
 import logging
 import matplotlib.patheffects as path_effects
+import multiprocessing
 import numpy as np
 import os
 import pandas as pd
 import re
+import struct
 import matplotlib as mpl
 mpl.use('Agg')
 
@@ -13,6 +17,8 @@ from os.path import basename
 from matplotlib import pyplot as plt
 from shutil import copyfile
 
+from .results import get_results_store
+
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -47,6 +53,21 @@ WATERMARK = False
 GATECH_USERNAME = 'DO NOT STEAL'
 TERM = 'Spring 2019'
 
+# Largest map (in cells) whose policy and value plots label every cell; larger maps are drawn as rasters and arrows
+MAX_LABELED_CELLS = 400
+
+# Unit vectors of the direction glyphs environments use in their direction maps
+ARROWS = {
+    '⬆': (0, 1),
+    '➡': (1, 0),
+    '⬇': (0, -1),
+    '⬅': (-1, 0),
+}
+
+# The PNG text chunk holding the content hash of a figure's inputs
+PNG_HASH_KEY = 'InputsHash'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
 
 def watermark(p):
 
@@ -127,79 +148,263 @@ def plot_episode_stats(title_base, stats, smoothing_window=50):
     return fig1, fig2, fig3
 
 
-def plot_policy_map(title, policy, map_desc, color_map, direction_map):
+def inputs_hash(*inputs):
+    """
+    A content hash of a figure's inputs (arrays, strings, numbers...), tagged onto its PNG by save_png so an image
+    whose inputs have not changed is not drawn again.
+    """
 
-    fig = plt.figure()
-    ax = fig.add_subplot(111, xlim=(0, policy.shape[1]), ylim=(0, policy.shape[0]))
-    font_size = 'x-large'
+    digest = hashlib.sha1()
+    for value in inputs:
+        if isinstance(value, np.ndarray):
+            digest.update('{}{}'.format(value.dtype.str, value.shape).encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, bytes):
+            digest.update(value)
+        else:
+            digest.update(repr(value).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def png_inputs_hash(file_name):
+    """
+    The inputs hash a PNG was saved with (see save_png), or None. Only the chunks ahead of the image data are read.
+    """
+
+    try:
+        with open(file_name, 'rb') as f:
+            if f.read(8) != PNG_SIGNATURE:
+                return None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return None
+                length, kind = struct.unpack('>I4s', header)
+                if kind in (b'IDAT', b'IEND'):
+                    return None
+                data = f.read(length)
+                f.seek(4, os.SEEK_CUR)
+                if kind == b'tEXt':
+                    key, _, value = data.partition(b'\0')
+                    if key == PNG_HASH_KEY.encode():
+                        return value.decode('latin-1')
+    except (IOError, OSError, struct.error):
+        return None
+
+
+def is_up_to_date(file_name, digest):
+    return png_inputs_hash(file_name) == digest
+
+
+def save_png(p, file_name, digest):
+    """
+    Save a figure (or pyplot) as a PNG tagged with its inputs hash. The file is replaced in one step, so a PNG is
+    never left half written with a valid tag.
+    """
+
+    temp_file_name = '{}.{}.tmp'.format(file_name, os.getpid())
+    p.savefig(temp_file_name, format='png', dpi=150, metadata={PNG_HASH_KEY: digest})
+    os.replace(temp_file_name, file_name)
+
+
+class MapPlotter(object):
+    """
+    Plots policies and value functions over one map. The tiles, cell borders and cell labels (or arrows, or shades on
+    maps of more than MAX_LABELED_CELLS cells) of each kind of plot are drawn once, into a figure that every later
+    plot reuses, swapping in only its title and cell data. Call close when done.
+    """
+
+    def __init__(self, map_desc, color_map, direction_map=None):
+        self._map_desc = map_desc
+        self._color_map = color_map
+        self._direction_map = direction_map
+        self._labeled = map_desc.size <= MAX_LABELED_CELLS
+        self._policy_template = None
+        self._value_template = None
+
+    def _new_figure(self):
+        # The tiles are one image and the cell borders two line collections, however large the map
+        rows, cols = self._map_desc.shape
+        fig = plt.figure()
+        ax = fig.add_subplot(111, xlim=(0, cols), ylim=(0, rows))
+
+        letters, cells = np.unique(self._map_desc, return_inverse=True)
+        tiles = np.array([mpl.colors.to_rgb(self._color_map[letter]) for letter in letters])
+        ax.imshow(tiles[cells.reshape(self._map_desc.shape)], extent=(0, cols, 0, rows), origin='upper',
+                  interpolation='nearest', aspect='auto')
+        ax.hlines(np.arange(rows + 1), 0, cols, colors='k', linewidth=0.1)
+        ax.vlines(np.arange(cols + 1), 0, rows, colors='k', linewidth=0.1)
+
+        ax.axis('off')
+        ax.set_xlim((0, cols))
+        ax.set_ylim((0, rows))
+        watermark(plt)
+
+        return fig, ax
+
+    def _show(self, fig, ax, title):
+        plt.figure(fig.number)
+        ax.set_title(title)
+        fig.tight_layout()
+        return fig
+
+    def plot_policy(self, title, policy):
+        """
+        Plot a policy: arrow glyphs on maps of up to MAX_LABELED_CELLS cells, one batched quiver of arrows on larger
+        maps.
+
+        :return: The figure
+        """
+
+        if self._policy_template is None:
+            self._policy_template = self._new_policy_template()
+        fig, ax, cells, artists = self._policy_template
+
+        glyphs = [self._direction_map[action] for action in policy[cells]]
+        if self._labeled:
+            for text, glyph in zip(artists, glyphs):
+                text.set_text(glyph)
+        else:
+            u, w = np.array([ARROWS.get(glyph, (0, 0)) for glyph in glyphs] or np.zeros((0, 2))).T
+            artists.set_UVC(u, w)
+
+        return self._show(fig, ax, title)
+
+    def _new_policy_template(self):
+        fig, ax = self._new_figure()
+        rows, cols = self._map_desc.shape
+        font_size = 'x-large'
+        if cols > 16:
+            font_size = 'small'
+
+        cells = np.nonzero(~np.isin(self._map_desc, [b'C', b'H', b'G']))
+        y, x = cells
+        if self._labeled:
+            artists = []
+            for i, j in zip(y, x):
+                text = ax.text(j+0.5, rows-i-0.5, '', weight='bold', size=font_size,
+                               horizontalalignment='center', verticalalignment='center', color='w')
+                # (matplotlib 3 lays out text artists too; 2.2 only has the axes decorations in its tight bbox)
+                if hasattr(text, 'set_in_layout'):
+                    text.set_in_layout(False)
+                text.set_path_effects([path_effects.Stroke(linewidth=2, foreground='black'),
+                                       path_effects.Normal()])
+                artists.append(text)
+        else:
+            artists = ax.quiver(x + 0.5, rows - y - 0.5, np.zeros(len(x)), np.zeros(len(x)), color='w',
+                                edgecolor='k', linewidth=0.3, angles='xy', scale_units='xy', scale=1/0.7,
+                                pivot='middle', minlength=0, width=0.25/max(rows, cols))
+
+        return fig, ax, cells, artists
+
+    def plot_value(self, title, v):
+        """
+        Plot a value function: the values written in cells shaded white (low) to red (high) on maps of up to
+        MAX_LABELED_CELLS cells; on larger maps the cells themselves take the shade, holes and goals keep their colors.
+
+        :return: The figure
+        """
+
+        if self._value_template is None:
+            self._value_template = self._new_value_template()
+        fig, ax, cells, artists = self._value_template
+
+        v_min = np.min(v)
+        v_max = np.max(v)
+        bins = np.linspace(v_min, v_max, 100)
+        v_red = np.digitize(v, bins)/100.0
+
+        if not self._labeled:
+            shades = np.dstack([np.ones_like(v_red), 1.0-v_red, 1.0-v_red, np.zeros_like(v_red)])
+            shades[cells + (3,)] = 1.0
+            artists.set_data(shades)
+            return self._show(fig, ax, title)
+
+        values = np.round(v, 1)
+        font_size = 'x-large'
+        # Values printed in more than three characters (negative, or 10 and over) take a smaller font
+        if v.shape[1] > 16 or np.any(np.signbit(values) | ((values >= 10) & np.isfinite(values))):
+            font_size = 'small'
+
+        for text, value, red in zip(artists, values[cells], v_red[cells]):
+            text.set_text(value)
+            text.set_color((1.0, 1.0-red, 1.0-red))
+            text.set_fontsize(font_size)
+
+        return self._show(fig, ax, title)
+
+    def _new_value_template(self):
+        fig, ax = self._new_figure()
+        rows, cols = self._map_desc.shape
+
+        cells = np.nonzero(~np.isin(self._map_desc, [b'H', b'G']))
+        if self._labeled:
+            artists = []
+            for i, j in zip(*cells):
+                text2 = ax.text(j+0.5, rows-i-0.5, '', horizontalalignment='center', verticalalignment='center')
+                # (matplotlib 3 lays out text artists too; 2.2 only has the axes decorations in its tight bbox)
+                if hasattr(text2, 'set_in_layout'):
+                    text2.set_in_layout(False)
+                text2.set_path_effects([path_effects.Stroke(linewidth=1, foreground='black'),
+                                       path_effects.Normal()])
+                artists.append(text2)
+        else:
+            artists = ax.imshow(np.zeros((rows, cols, 4)), extent=(0, cols, 0, rows), origin='upper',
+                                interpolation='nearest', aspect='auto')
 
-    if policy.shape[1] > 16:
-        font_size = 'small'
-    plt.title(title)
-    for i in range(policy.shape[0]):
-        for j in range(policy.shape[1]):
-            y = policy.shape[0] - i - 1
-            x = j
-            p = plt.Rectangle([x, y], 1, 1, edgecolor='k', linewidth=0.1)
-            p.set_facecolor(color_map[map_desc[i, j]])
-            ax.add_patch(p)
-            if map_desc[i, j] in b'CHG':
-                continue
-            text = ax.text(x+0.5, y+0.5, direction_map[policy[i, j]], weight='bold', size=font_size,
-                           horizontalalignment='center', verticalalignment='center', color='w')
-            text.set_path_effects([path_effects.Stroke(linewidth=2, foreground='black'),
-                                   path_effects.Normal()])
-    plt.axis('off')
-    plt.xlim((0, policy.shape[1]))
-    plt.ylim((0, policy.shape[0]))
-    plt.tight_layout()
+        return fig, ax, cells, artists
 
-    return watermark(plt)
+    def _inputs_hash(self, kind, title, data):
+        return inputs_hash(kind, title, data, self._map_desc, self._color_map, self._direction_map, self._labeled,
+                           WATERMARK)
 
+    def save_policy(self, file_name, title, policy):
+        """
+        Plot a policy to a PNG file, unless the file is already a plot of the same inputs.
 
-def plot_value_map(title, v, map_desc, color_map):
+        :return: True if the file was written
+        """
 
-    fig = plt.figure()
-    ax = fig.add_subplot(111, xlim=(0, v.shape[1]), ylim=(0, v.shape[0]))
-    font_size = 'x-large'
-    if v.shape[1] > 16:
-        font_size = 'small'
-
-    v_min = np.min(v)
-    v_max = np.max(v)
-    bins = np.linspace(v_min, v_max, 100)
-    v_red = np.digitize(v, bins)/100.0
-    for i in range(v.shape[0]):
-        for j in range(v.shape[1]):
-            value = np.round(v[i, j], 1)
-            if len(str(value)) > 3:
-                font_size = 'small'
+        digest = self._inputs_hash('policy', title, policy)
+        if is_up_to_date(file_name, digest):
+            return False
+        save_png(self.plot_policy(title, policy), file_name, digest)
+        return True
 
-    plt.title(title)
-    for i in range(v.shape[0]):
-        for j in range(v.shape[1]):
-            y = v.shape[0] - i - 1
-            x = j
-            p = plt.Rectangle([x, y], 1, 1, edgecolor='k', linewidth=0.1)
-            p.set_facecolor(color_map[map_desc[i, j]])
-            ax.add_patch(p)
-
-            value = np.round(v[i, j], 1)
-
-            red = v_red[i, j]
-            if map_desc[i, j] in b'HG':
-                continue
-            text2 = ax.text(x+0.5, y+0.5, value, size=font_size,
-                            horizontalalignment='center', verticalalignment='center', color=(1.0, 1.0-red, 1.0-red))
-            text2.set_path_effects([path_effects.Stroke(linewidth=1, foreground='black'),
-                                   path_effects.Normal()])
-
-    plt.axis('off')
-    plt.xlim((0, v.shape[1]))
-    plt.ylim((0, v.shape[0]))
-    plt.tight_layout()
+    def save_value(self, file_name, title, v):
+        """
+        Plot a value function to a PNG file, unless the file is already a plot of the same inputs.
+
+        :return: True if the file was written
+        """
+
+        digest = self._inputs_hash('value', title, v)
+        if is_up_to_date(file_name, digest):
+            return False
+        save_png(self.plot_value(title, v), file_name, digest)
+        return True
+
+    def close(self):
+        for template in (self._policy_template, self._value_template):
+            if template is not None:
+                plt.close(template[0])
+        self._policy_template = None
+        self._value_template = None
+
+
+def plot_policy_map(title, policy, map_desc, color_map, direction_map):
+
+    MapPlotter(map_desc, color_map, direction_map).plot_policy(title, policy)
+
+    return plt
 
-    return watermark(plt)
+
+def plot_value_map(title, v, map_desc, color_map):
+
+    MapPlotter(map_desc, color_map).plot_value(title, v)
+
+    return plt
 
 
 def plot_time_vs_steps(title, df, xlabel="Steps", ylabel="Time (s)"):
@@ -281,7 +486,11 @@ def fetch_mdp_name(file, regexp):
 
     mdp_name = search_result.groups()[0]
 
-    return mdp_name, ' '.join(map(lambda x: x.capitalize(), mdp_name.split('_')))
+    return mdp_name, readable_mdp_name(mdp_name)
+
+
+def readable_mdp_name(mdp_name):
+    return ' '.join(map(lambda x: x.capitalize(), mdp_name.split('_')))
 
 
 def process_params(problem_name, params):
@@ -294,19 +503,35 @@ def process_params(problem_name, params):
     return param_str
 
 
-def find_optimal_params(problem_name, base_dir, file_regex):
+def find_grids(problem_name, base_dir, file_regex, store=None):
+    """
+    The latest grid of every MDP of a problem, from the results store if there is one or else from the grid files.
+
+    :return: List of (mdp, readable mdp, grid DataFrame) tuples
+    """
+
+    if store is not None:
+        mdps = store.envs(problem_name)
+        logger.info("Grids in the results store {}".format(mdps))
+        return [(mdp, readable_mdp_name(mdp), store.grid(problem_name, mdp)) for mdp in mdps]
 
     grid_files = glob.glob(os.path.join(base_dir, '*_grid*.csv'))
     logger.info("Grid files {}".format(grid_files))
+    return [fetch_mdp_name(f, file_regex) + (pd.read_csv(f),) for f in grid_files]
+
+
+def find_optimal_params(problem_name, base_dir, file_regex, store=None):
+
     best_params = {}
-    for f in grid_files:
-        mdp, readable_mdp = fetch_mdp_name(f, file_regex)
+    for mdp, readable_mdp, df in find_grids(problem_name, base_dir, file_regex, store):
         logger.info("MDP: {}, Readable MDP: {}".format(mdp, readable_mdp))
-        df = pd.read_csv(f)
         best = df.copy()
         # Attempt to find the best params. First look at the reward mean, then median, then max. If at any point we
         # have more than one result as "best", try the next criterion
         for criterion in ['reward_median', 'reward_max', 'reward_mean']:
+            # (exactly scored grids have no median or max)
+            if best[criterion].isnull().all():
+                continue
             best_value = np.max(best[criterion])
             best = best[best[criterion] == best_value]
             if best.shape[0] == 1:
@@ -359,7 +584,23 @@ def find_policy_images(base_dir, params):
     return policy_images
 
 
-def find_data_files(base_dir, params):
+def export_data_files(problem_name, base_dir, params, store):
+    """
+    Write the series of each MDP's best grid point from the results store to the CSV files find_data_files looks for.
+    """
+
+    for mdp in params:
+        mdp_params = params[mdp]
+        for name, suffix in [('steps', ''), ('optimal', '_optimal'), ('episode', '_episode')]:
+            file_name = os.path.join(base_dir, '{}_{}{}.csv'.format(mdp_params['name'], mdp_params['param_str'], suffix))
+            if store.export_series(problem_name, mdp, mdp_params['params'], name, file_name):
+                logger.info("Exported {} series of {} to {}".format(name, mdp, file_name))
+
+
+def find_data_files(base_dir, params, store=None, problem_name=None):
+
+    if store is not None:
+        export_data_files(problem_name, base_dir, params, store)
 
     data_files = {}
     for mdp in params:
@@ -422,56 +663,90 @@ def copy_data_files(data_files, base_dir):
                 copyfile(file_name, file_dest)
 
 
-def plot_data(data_files, envs, base_dir):
+def plot_data(data_files, envs, base_dir, processes=1):
+    """
+    Plot the time, reward and delta (and for QL, episode) figures of each MDP's data files, in a pool of processes
+    processes if more than one. A figure whose PNG already plots the same data files is not drawn again.
 
+    The per-config policy and value maps are not drawn here: each grid point's experiment writes its own (see
+    ExperimentStats.plot_policies_on_map), so they are spread over the grid's worker processes instead.
+    """
+
+    tasks = []
     for problem_name in data_files:
         for mdp in data_files[problem_name]:
             env = lookup_env_from_mdp(envs, mdp)
             if env is None:
                 logger.error("Unable to find env for MDP {}".format(mdp))
-                return
+                continue
 
-            mdp_files = data_files[problem_name][mdp]
+            tasks.append((problem_name, mdp, env['readable_name'], data_files[problem_name][mdp], base_dir))
 
-            step_term = 'Steps'
-            if problem_name == 'QL':
-                step_term = 'Episodes'
-
-            df = pd.read_csv(mdp_files['file'])
-
-            title = '{}: {} - Time vs {}'.format(env['readable_name'],
-                                                 problem_name_to_descriptive_name(problem_name), step_term)
-            file_name = os.path.join(os.path.join(base_dir, problem_name), '{}_time.png'.format(mdp))
-            p = plot_time_vs_steps(title, df, xlabel=step_term)
-            p = watermark(p)
-            p.savefig(file_name, format='png', dpi=150)
-            p.close()
-
-            reward_term = 'Reward'
-            if problem_name in ['VI', 'PI']:
-                reward_term = 'Value'
-
-            title = '{}: {} - {} and Delta vs {}'.format(env['readable_name'],
-                                                         problem_name_to_descriptive_name(problem_name),
-                                                         reward_term, step_term)
-            file_name = os.path.join(os.path.join(base_dir, problem_name), '{}_reward_delta.png'.format(mdp))
-            p = plot_reward_and_delta_vs_steps(title, df, ylabel=reward_term, xlabel=step_term)
-            p = watermark(p)
-            p.savefig(file_name, format='png', dpi=150)
-            p.close()
-
-            if problem_name == 'QL' and 'episode_file' in mdp_files:
-                title = '{}: {} - {}'.format(env['readable_name'], problem_name_to_descriptive_name(problem_name),
-                                             '{}')
-                episode_df = pd.read_csv(mdp_files['episode_file'])
-                q_length, q_reward, q_time = plot_episode_stats(title, episode_df)
-                file_base = os.path.join(os.path.join(base_dir, problem_name), '{}_{}.png'.format(mdp, '{}'))
-
-                logger.info("Plotting episode stats with file base {}".format(file_base))
-                q_length.savefig(file_base.format('episode_length'), format='png', dpi=150)
-                q_reward.savefig(file_base.format('episode_reward'), format='png', dpi=150)
-                q_time.savefig(file_base.format('episode_time'), format='png', dpi=150)
-                plt.close()
+    if processes > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(processes, len(tasks)))
+        try:
+            pool.starmap(plot_mdp_data, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            plot_mdp_data(*task)
+
+
+def plot_mdp_data(problem_name, mdp, readable_name, mdp_files, base_dir):
+
+    step_term = 'Steps'
+    if problem_name == 'QL':
+        step_term = 'Episodes'
+
+    with open(mdp_files['file'], 'rb') as f:
+        data = f.read()
+    df = None
+
+    title = '{}: {} - Time vs {}'.format(readable_name, problem_name_to_descriptive_name(problem_name), step_term)
+    file_name = os.path.join(os.path.join(base_dir, problem_name), '{}_time.png'.format(mdp))
+    digest = inputs_hash('time', title, data, WATERMARK)
+    if not is_up_to_date(file_name, digest):
+        df = pd.read_csv(io.BytesIO(data))
+        p = plot_time_vs_steps(title, df, xlabel=step_term)
+        p = watermark(p)
+        save_png(p, file_name, digest)
+        p.close()
+
+    reward_term = 'Reward'
+    if problem_name in ['VI', 'PI']:
+        reward_term = 'Value'
+
+    title = '{}: {} - {} and Delta vs {}'.format(readable_name, problem_name_to_descriptive_name(problem_name),
+                                                 reward_term, step_term)
+    file_name = os.path.join(os.path.join(base_dir, problem_name), '{}_reward_delta.png'.format(mdp))
+    digest = inputs_hash('reward_delta', title, data, WATERMARK)
+    if not is_up_to_date(file_name, digest):
+        if df is None:
+            df = pd.read_csv(io.BytesIO(data))
+        p = plot_reward_and_delta_vs_steps(title, df, ylabel=reward_term, xlabel=step_term)
+        p = watermark(p)
+        save_png(p, file_name, digest)
+        p.close()
+
+    if problem_name == 'QL' and 'episode_file' in mdp_files:
+        title = '{}: {} - {}'.format(readable_name, problem_name_to_descriptive_name(problem_name), '{}')
+        file_base = os.path.join(os.path.join(base_dir, problem_name), '{}_{}.png'.format(mdp, '{}'))
+        with open(mdp_files['episode_file'], 'rb') as f:
+            episode_data = f.read()
+        digest = inputs_hash('episode', title, episode_data, WATERMARK)
+        names = ['episode_length', 'episode_reward', 'episode_time']
+        if all(is_up_to_date(file_base.format(name), digest) for name in names):
+            return
+
+        episode_df = pd.read_csv(io.BytesIO(episode_data))
+        figures = plot_episode_stats(title, episode_df)
+
+        logger.info("Plotting episode stats with file base {}".format(file_base))
+        for name, figure in zip(names, figures):
+            save_png(figure, file_base.format(name), digest)
+            plt.close(figure)
 
 
 def lookup_env_from_mdp(envs, mdp):
@@ -494,11 +769,20 @@ def problem_name_to_descriptive_name(problem_name):
     return 'Unknown'
 
 
-def plot_results(envs):
+def plot_results(envs, processes=1):
+    """
+    Collect the best grid point of each problem and MDP into the report directory and plot its data.
+
+    :param processes: Number of processes plotting the report's figures (one per CPU if not positive)
+    """
+
+    if processes is None or processes < 1:
+        processes = multiprocessing.cpu_count()
 
     best_params = {}
     best_images = {}
     data_files = {}
+    store = get_results_store()
     for problem_name in TO_PROCESS:
         logger.info("Processing {}".format(problem_name))
 
@@ -506,13 +790,13 @@ def plot_results(envs):
         problem_path = os.path.join(INPUT_PATH, problem['path'])
         problem_image_path = os.path.join(os.path.join(INPUT_PATH, 'images'), problem['path'])
 
-        best_params[problem_name] = find_optimal_params(problem_name, problem_path, problem['file_regex'])
+        best_params[problem_name] = find_optimal_params(problem_name, problem_path, problem['file_regex'], store)
         best_images[problem_name] = find_policy_images(problem_image_path, best_params[problem_name])
-        data_files[problem_name] = find_data_files(problem_path, best_params[problem_name])
+        data_files[problem_name] = find_data_files(problem_path, best_params[problem_name], store, problem_name)
 
     copy_best_images(best_images, REPORT_PATH)
     copy_data_files(data_files, REPORT_PATH)
-    plot_data(data_files, envs, REPORT_PATH)
+    plot_data(data_files, envs, REPORT_PATH, processes)
     params_df = pd.DataFrame(best_params)
     params_df.to_csv(os.path.join(REPORT_PATH, 'params.csv'))
 
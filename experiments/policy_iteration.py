@@ -1,9 +1,8 @@
-import json
 import os
 import time
 import numpy as np
 
-from .base import BaseExperiment, OUTPUT_DIR
+from .base import BaseExperiment, OUTPUT_DIR, SCORING, TRIAL_TOLERANCE, MIN_TRIALS
 
 import solvers
 
@@ -13,6 +12,7 @@ MAX_STEPS = 2000
 NUM_TRIALS = 100
 DISCOUNTS = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
 THETA = 0.0001
+EVALUATION = 'iterative'
 
 
 PI_DIR = os.path.join(OUTPUT_DIR, 'PI')
@@ -28,13 +28,18 @@ if not os.path.exists(IMG_DIR):
 
 class PolicyIterationExperiment(BaseExperiment):
 
+    PROBLEM = 'PI'
+    SETTINGS = BaseExperiment.SETTINGS + ('_num_trials', '_theta', '_evaluation')
+
     def __init__(self, details, verbose=False, max_steps = MAX_STEPS, num_trials = NUM_TRIALS, theta = THETA,
-                 discounts = DISCOUNTS):
-        super(PolicyIterationExperiment, self).__init__(details, verbose, max_steps)
+                 discounts = DISCOUNTS, evaluation = EVALUATION, scoring = SCORING,
+                 trial_tolerance = TRIAL_TOLERANCE, min_trials = MIN_TRIALS):
+        super(PolicyIterationExperiment, self).__init__(details, verbose, max_steps, scoring, trial_tolerance, min_trials)
         self._num_trials = num_trials
         self._max_steps = max_steps
         self._theta = theta
         self._discount_factors = discounts
+        self._evaluation = evaluation
 
     def convergence_check_fn(self, solver, step_count):
         return solver.has_converged()
@@ -42,46 +47,53 @@ class PolicyIterationExperiment(BaseExperiment):
     def perform(self):
         # Policy iteration
         self._details.env.reset()
-        map_desc = self._details.env.unwrapped.desc
+        solvers.compile_mdp(self._details.env)
 
         grid_file_name = os.path.join(PI_DIR, '{}_grid.csv'.format(self._details.env_name))
-        with open(grid_file_name, 'w') as f:
-            f.write("params,time,steps,reward_mean,reward_median,reward_min,reward_max,reward_std\n")
 
         dims = len(self._discount_factors)
         self.log("Searching PI in {} dimensions".format(dims))
 
-        runs = 1
-        for discount_factor in self._discount_factors:
-            t = time.clock()
-            self.log("{}/{} Processing PI with discount factor {}".format(runs, dims, discount_factor))
+        # Every discount factor is a task of its own
+        self.run_grid(grid_file_name, [[(runs, {'discount_factor': discount_factor})]
+                                       for runs, discount_factor in enumerate(self._discount_factors, 1)])
+
+    def run_grid_point(self, runs, params):
+        _, rollout_rng = self.task_rngs(params)
+        discount_factor = params['discount_factor']
+        map_desc = self._details.env.unwrapped.desc
+        mdp = solvers.compile_mdp(self._details.env)
+
+        t = time.clock()
+        self.log("{}/{} Processing PI with discount factor {}".format(runs, len(self._discount_factors), discount_factor))
 
+        results = self.cached_results(params)
+        if results is None:
             p = solvers.PolicyIterationSolver(self._details.env, discount_factor=discount_factor,
                                               max_policy_eval_steps=self._max_steps, theta=self._theta,
-                                              verbose=self._verbose)
-
-            stats = self.run_solver_and_collect(p, self.convergence_check_fn)
-
-            self.log("Took {} steps".format(len(stats.steps)))
-            stats.to_csv(os.path.join(PI_DIR, '{}_{}.csv'.format(self._details.env_name, discount_factor)))
-            stats.pickle_results(os.path.join(PKL_DIR, '{}_{}_{}.pkl'.format(self._details.env_name, discount_factor, '{}')), map_desc.shape)
-            stats.plot_policies_on_map(os.path.join(IMG_DIR, '{}_{}_{}.png'.format(self._details.env_name, discount_factor, '{}_{}')),
-                                       map_desc, self._details.env.colors(), self._details.env.directions(),
-                                       'Policy Iteration', 'Step', self._details, only_last=True)
-
-            optimal_policy_stats = self.run_policy_and_collect(p, stats.optimal_policy, self._num_trials)
-            self.log('{}'.format(optimal_policy_stats))
-            optimal_policy_stats.to_csv(os.path.join(PI_DIR, '{}_{}_optimal.csv'.format(self._details.env_name, discount_factor)))
-            with open(grid_file_name, 'a') as f:
-                f.write('"{}",{},{},{},{},{},{},{}\n'.format(
-                    json.dumps({'discount_factor': discount_factor}).replace('"', '""'),
-                    time.clock() - t,
-                    len(optimal_policy_stats.rewards),
-                    optimal_policy_stats.reward_mean,
-                    optimal_policy_stats.reward_median,
-                    optimal_policy_stats.reward_min,
-                    optimal_policy_stats.reward_max,
-                    optimal_policy_stats.reward_std,
-                ))
-            runs += 1
-
+                                              verbose=self._verbose, mdp=mdp,
+                                              evaluation=self._evaluation)
+            stats = self.run_solver_and_collect(p, self.convergence_check_fn, checkpoint=params)
+            optimal_policy_stats = self.run_policy_and_collect(p, stats.optimal_policy, self._num_trials,
+                                                              rng=rollout_rng)
+            results = {'stats': stats, 'optimal': optimal_policy_stats, 'elapsed': time.clock() - t}
+            self.cache_results(params, results)
+        # A cached point is timed as its solver originally took
+        t = time.clock() - results['elapsed']
+        stats = results['stats']
+        optimal_policy_stats = results['optimal']
+
+        self.log("Took {} steps".format(len(stats.steps)))
+        self.save_series(params, 'steps', stats,
+                         os.path.join(PI_DIR, '{}_{}.csv'.format(self._details.env_name, discount_factor)))
+        self.save_snapshots(params, stats, os.path.join(PKL_DIR, '{}_{}_{}.pkl'.format(self._details.env_name, discount_factor, '{}')),
+                            map_desc.shape)
+        self.output(stats.plot_policies_on_map, os.path.join(IMG_DIR, '{}_{}_{}.png'.format(self._details.env_name, discount_factor, '{}_{}')),
+                    map_desc, self._details.env.colors(), self._details.env.directions(),
+                    'Policy Iteration', 'Step', self._details, only_last=True)
+
+        self.log('{}'.format(optimal_policy_stats))
+        self.save_series(params, 'optimal', optimal_policy_stats,
+                         os.path.join(PI_DIR, '{}_{}_optimal.csv'.format(self._details.env_name, discount_factor)))
+
+        return self.grid_row(params, time.clock() - t, optimal_policy_stats)
@@ -1,9 +1,14 @@
-import json
+import math
 import os
 import time
 import numpy as np
 
-from .base import BaseExperiment, OUTPUT_DIR
+try:
+    import skopt
+except ImportError:
+    skopt = None
+
+from .base import BaseExperiment, OUTPUT_DIR, SCORING, TRIAL_TOLERANCE, MIN_TRIALS, MAX_SNAPSHOTS
 
 import solvers
 
@@ -21,6 +26,15 @@ EPS_DECAYS = [0.0001]
 DISCOUNTS = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
 MIN_SUB_THETAS = 5
 THETA = 0.0001
+LOCKSTEP = True
+LOCKSTEP_BATCH_SIZE = 60
+SPILL_SNAPSHOTS = True
+SEARCH = 'grid'
+SEARCHES = ['grid', 'halving', 'hyperband', 'bayes']
+ETA = 3
+ROLLING_EPISODES = 100
+BAYES_CALLS = 30
+BAYES_BATCH = 3
 
 
 QL_DIR = os.path.join(OUTPUT_DIR, 'QL')
@@ -36,10 +50,34 @@ if not os.path.exists(IMG_DIR):
 
 class QLearnerExperiment(BaseExperiment):
 
+    PROBLEM = 'QL'
+    SETTINGS = BaseExperiment.SETTINGS + ('_num_trials', '_max_episodes', '_min_episodes', '_max_episode_steps',
+                                          '_min_sub_thetas', '_theta', '_lockstep')
+
     def __init__(self, details, verbose=False, max_steps = MAX_STEPS, num_trials = NUM_TRIALS,
                  max_episodes = MAX_EPISODES, min_episodes = MIN_EPISODES, max_episode_steps = MAX_EPISODE_STEPS, 
                  min_sub_thetas = MIN_SUB_THETAS, theta = THETA, discounts = DISCOUNTS,
-                 alphas = ALPHAS, q_inits = Q_INITS, epsilons = EPSILONS, epsilon_decays = EPS_DECAYS):
+                 alphas = ALPHAS, q_inits = Q_INITS, epsilons = EPSILONS, epsilon_decays = EPS_DECAYS,
+                 lockstep = LOCKSTEP, scoring = SCORING,
+                 trial_tolerance = TRIAL_TOLERANCE, min_trials = MIN_TRIALS,
+                 search = SEARCH, eta = ETA, bayes_calls = BAYES_CALLS):
+        """
+        :param search: 'grid' runs every configuration. The adaptive searches first screen configurations by learning
+            them for part of max_episodes, without any output, and only run the best of them in full (so the grid file
+            holds just those): 'halving' is successive halving over every configuration, 'hyperband' runs successive
+            halving in brackets of randomly sampled configurations and first budgets, and 'bayes' screens configurations
+            proposed by Bayesian optimization (needs scikit-optimize).
+        :param eta: Each round of successive halving keeps the best 1/eta of its configurations and learns them for
+            eta times as many episodes. The smallest budget is min_episodes.
+        :param bayes_calls: Number of configurations Bayesian optimization proposes, in batches of BAYES_BATCH; the best
+            1/eta of those it screens run in full
+        """
+
+        if search not in SEARCHES:
+            raise ValueError('Unknown search: {}'.format(search))
+        if search == 'bayes' and skopt is None:
+            raise ImportError('The bayes search needs scikit-optimize (see requirements.txt)')
+
         self._max_episodes = max_episodes
         self._max_episode_steps = max_episode_steps
         self._min_episodes = min_episodes
@@ -51,10 +89,14 @@ class QLearnerExperiment(BaseExperiment):
         self._alphas = alphas
         self._q_inits = q_inits
         self._epsilons = epsilons
+        self._lockstep = lockstep
+        self._search = search
+        self._eta = eta
+        self._bayes_calls = bayes_calls
         if type(epsilon_decays) != list:
             epsilon_decays = list(epsilon_decays)
 
-        super(QLearnerExperiment, self).__init__(details, verbose, max_steps)
+        super(QLearnerExperiment, self).__init__(details, verbose, max_steps, scoring, trial_tolerance, min_trials)
 
     def convergence_check_fn(self, solver, step_count):
         return solver.has_converged()
@@ -62,78 +104,299 @@ class QLearnerExperiment(BaseExperiment):
     def perform(self):
         # Q-Learner
         self._details.env.reset()
-        map_desc = self._details.env.unwrapped.desc
 
         grid_file_name = os.path.join(QL_DIR, '{}_grid.csv'.format(self._details.env_name))
-        with open(grid_file_name, 'w') as f:
-            f.write("params,time,steps,reward_mean,reward_median,reward_min,reward_max,reward_std\n")
-
-        dims = len(self._discount_factors) * len(self._alphas) * len(self._q_inits) * len(self._epsilons) * len(self._epsilon_decays)
-        self.log("Searching Q in {} dimensions".format(dims))
-
-        runs = 1
-        for alpha in self._alphas:
-            for q_init in self._q_inits:
-                for epsilon in self._epsilons:
-                    for epsilon_decay in self._epsilon_decays:
-                        for discount_factor in self._discount_factors:
-                            t = time.clock()
-                            self.log("{}/{} Processing QL with alpha {}, q_init {}, epsilon {}, epsilon_decay {},"
-                                     " discount_factor {}".format(
-                                runs, dims, alpha, q_init, epsilon, epsilon_decay, discount_factor
-                            ))
-
-                            qs = solvers.QLearningSolver(self._details.env, self._max_episodes, self._min_episodes,
-                                                         max_steps_per_episode = self._max_episode_steps,
-                                                         discount_factor = discount_factor,
-                                                         alpha = alpha,
-                                                         epsilon = epsilon, epsilon_decay = epsilon_decay,
-                                                         q_init = q_init,
-                                                         min_consecutive_sub_theta_episodes = self._min_sub_thetas,
-                                                         verbose = self._verbose, theta = self._theta)
-
-                            stats = self.run_solver_and_collect(qs, self.convergence_check_fn)
-
-                            self.log("Took {} episodes".format(len(stats.steps)))
-                            stats.to_csv(os.path.join(QL_DIR, '{}_{}_{}_{}_{}_{}.csv'.format(self._details.env_name,
-                                                      alpha, q_init, epsilon, epsilon_decay, discount_factor)))
-                            stats.pickle_results(os.path.join(PKL_DIR, '{}_{}_{}_{}_{}_{}_{}.pkl'.format(self._details.env_name,
-                                                 alpha, q_init, epsilon, epsilon_decay, discount_factor, '{}')), map_desc.shape,
-                                                 step_size = self._max_episodes / 20.0)
-                            stats.plot_policies_on_map(os.path.join(IMG_DIR, '{}_{}_{}_{}_{}_{}_{}.png'.format(self._details.env_name,
-                                                       alpha, q_init, epsilon, epsilon_decay, discount_factor, '{}_{}')),
-                                                       map_desc, self._details.env.colors(),
-                                                       self._details.env.directions(),
-                                                       'Q-Learner', 'Episode', self._details,
-                                                       step_size = self._max_episodes / 20.0,
-                                                       only_last = True)
-
-                            # We have extra stats about the episode we might want to look at later
-                            episode_stats = qs.get_stats()
-                            episode_stats.to_csv(os.path.join(QL_DIR, '{}_{}_{}_{}_{}_{}_episode.csv'.format(self._details.env_name,
-                                                 alpha, q_init, epsilon, epsilon_decay, discount_factor)))
-
-                            optimal_policy_stats = self.run_policy_and_collect(qs, stats.optimal_policy, self._num_trials)
-                            self.log('{}'.format(optimal_policy_stats))
-                            optimal_policy_stats.to_csv(os.path.join(QL_DIR, '{}_{}_{}_{}_{}_{}_optimal.csv'.format(self._details.env_name,
-                                                        alpha, q_init, epsilon, epsilon_decay, discount_factor)))
-
-                            with open(grid_file_name, 'a') as f:
-                                f.write('"{}",{},{},{},{},{},{},{}\n'.format(
-                                    json.dumps({
-                                        'alpha': alpha,
-                                        'q_init': q_init,
-                                        'epsilon': epsilon,
-                                        'epsilon_decay': epsilon_decay,
-                                        'discount_factor': discount_factor,
-                                    }).replace('"', '""'),
-                                    time.clock() - t,
-                                    len(optimal_policy_stats.rewards),
-                                    optimal_policy_stats.reward_mean,
-                                    optimal_policy_stats.reward_median,
-                                    optimal_policy_stats.reward_min,
-                                    optimal_policy_stats.reward_max,
-                                    optimal_policy_stats.reward_std,
-                                ))
-                            runs += 1
 
+        self.log("Searching Q in {} dimensions".format(self._dims()))
+
+        configs = list(enumerate([{
+            'alpha': alpha,
+            'q_init': q_init,
+            'epsilon': epsilon,
+            'epsilon_decay': epsilon_decay,
+            'discount_factor': discount_factor,
+        } for alpha in self._alphas for q_init in self._q_inits for epsilon in self._epsilons
+            for epsilon_decay in self._epsilon_decays for discount_factor in self._discount_factors], 1))
+
+        if self._search != 'grid':
+            search = {'halving': self._halving_configs, 'hyperband': self._hyperband_configs,
+                      'bayes': self._bayes_configs}[self._search]
+            configs = search(configs)
+            self.log("Running {} of {} QL configurations in full".format(len(configs), self._dims()))
+
+        # In lockstep, each task learns a batch of configurations at once; batches are kept small enough for every
+        # worker to get one
+        batch_size = 1
+        if self._lockstep:
+            batch_size = min(LOCKSTEP_BATCH_SIZE, int(math.ceil(len(configs) / self.grid_workers(len(configs)))))
+        self.run_grid(grid_file_name, [configs[start:start + batch_size]
+                                       for start in range(0, len(configs), batch_size)])
+
+    def run_grid_chunk(self, index, chunk):
+        if not self._lockstep:
+            return super(QLearnerExperiment, self).run_grid_chunk(index, chunk)
+
+        # Learn the batch's uncached configurations at once, then collect each one's results as if it had run on its
+        # own
+        rngs = [self.task_rngs(config) for _, config in chunk]
+        results = [self.cached_results(config) for _, config in chunk]
+        pending = [i for i, r in enumerate(results) if r is None]
+        if pending:
+            t = time.clock()
+            self.log("{}-{}/{} Processing QL configurations in lockstep".format(chunk[0][0], chunk[-1][0], self._dims()))
+            batched = solvers.BatchedQLearningSolver(self._details.env, [chunk[i][1] for i in pending],
+                                                     self._max_episodes, self._min_episodes,
+                                                     max_steps_per_episode = self._max_episode_steps,
+                                                     theta = self._theta,
+                                                     min_consecutive_sub_theta_episodes = self._min_sub_thetas,
+                                                     max_runs = self._max_steps, verbose = self._verbose,
+                                                     rngs = [rngs[i][0] for i in pending],
+                                                     snapshot_step_size = self._snapshot_step_size())
+            recorded = self.run_checkpointed([chunk[i][1] for i in pending], batched.run)
+            batch_time = (time.clock() - t) / len(pending)
+
+            for i, qs in zip(pending, recorded):
+                runs, config = chunk[i]
+                self._log_config(runs, config)
+                results[i] = self._solve(qs, config, time.clock() - batch_time, rngs[i][1])
+
+        return [self._write_results(config, r) for (_, config), r in zip(chunk, results)]
+
+    def run_grid_point(self, runs, params):
+        solver_rng, rollout_rng = self.task_rngs(params)
+        t = time.clock()
+        self._log_config(runs, params)
+        results = self.cached_results(params)
+        if results is not None:
+            return self._write_results(params, results)
+        qs = solvers.QLearningSolver(self._details.env, self._max_episodes, self._min_episodes,
+                                     max_steps_per_episode = self._max_episode_steps,
+                                     discount_factor = params['discount_factor'],
+                                     alpha = params['alpha'],
+                                     epsilon = params['epsilon'], epsilon_decay = params['epsilon_decay'],
+                                     q_init = params['q_init'],
+                                     min_consecutive_sub_theta_episodes = self._min_sub_thetas,
+                                     verbose = self._verbose, theta = self._theta, rng = solver_rng)
+        return self._write_results(params, self._solve(qs, params, t, rollout_rng))
+
+    def _dims(self):
+        return len(self._discount_factors) * len(self._alphas) * len(self._q_inits) * len(self._epsilons) * \
+            len(self._epsilon_decays)
+
+    def _full_budget(self):
+        # Most episodes a configuration's full run learns for
+        return int(min(self._max_episodes, self._max_steps))
+
+    def _halvings(self):
+        # Number of times a full run's budget can be divided by eta, staying at or above min_episodes
+        halvings = 0
+        while self._full_budget() / self._eta ** (halvings + 1) >= max(self._min_episodes, 1):
+            halvings += 1
+        return halvings
+
+    def score_config(self, config, episodes, state=None):
+        """
+        Learn a configuration for up to a budget of episodes (fewer if it converges first), without writing any
+        output, and score it by its mean reward over the last ROLLING_EPISODES episodes. It learns from the same random
+        numbers as its full run would.
+
+        :param config: Dict of the configuration's parameters
+        :param episodes: Budget of episodes
+        :param state: Solver state (see BaseSolver.get_state) the configuration was left in by a smaller budget, to
+            learn on from, or None to start afresh
+        :return: Tuple of the score and the solver state
+        """
+
+        solver_rng, _ = self.task_rngs(config)
+        qs = solvers.QLearningSolver(self._details.env, self._max_episodes, self._min_episodes,
+                                     max_steps_per_episode = self._max_episode_steps,
+                                     discount_factor = config['discount_factor'],
+                                     alpha = config['alpha'],
+                                     epsilon = config['epsilon'], epsilon_decay = config['epsilon_decay'],
+                                     q_init = config['q_init'],
+                                     min_consecutive_sub_theta_episodes = self._min_sub_thetas,
+                                     verbose = self._verbose, theta = self._theta, rng = solver_rng)
+        steps = 0
+        if state is not None:
+            qs.set_state(state)
+            steps = state['_steps']
+        while steps < episodes and not qs.has_converged():
+            steps = qs.step()[2]
+
+        rewards = qs.get_stats().episode_rewards[:steps]
+        score = float(np.mean(rewards[-ROLLING_EPISODES:])) if steps else float('-inf')
+        return score, qs.get_state()
+
+    def _successive_halving(self, configs, budget):
+        """
+        Successive halving: learn every configuration for a budget of episodes, then keep the best 1/eta of them and
+        learn those on to eta times the budget, until the budget reaches a full run's.
+
+        :param configs: List of (run number, config) configurations
+        :param budget: Episodes of the first round
+        :return: The (run number, config) configurations left for a full run
+        """
+
+        points = [(runs, config, None) for runs, config in configs]
+        while budget < self._full_budget() and len(points) > 1:
+            scores = self.map_points('score_config', [(config, budget, state) for _, config, state in points])
+            best = sorted(sorted(range(len(points)), key=lambda i: -scores[i][0])[:max(1, len(points) // self._eta)])
+            self.log("Kept {} of {} QL configurations after {} episodes".format(len(best), len(points), budget))
+            points = [(points[i][0], points[i][1], scores[i][1]) for i in best]
+            budget = int(math.ceil(budget * self._eta))
+        return [(runs, config) for runs, config, _ in points]
+
+    def _halving_configs(self, configs):
+        halvings = self._halvings()
+        return self._successive_halving(configs, int(math.ceil(self._full_budget() / self._eta ** halvings)))
+
+    def _hyperband_configs(self, configs):
+        """
+        Hyperband: successive halving in brackets that trade the number of randomly sampled configurations off
+        against their first budget, from many configurations learning for min_episodes to a few learning in full from
+        the start. If a full run's budget is less than eta times min_episodes, there is no room to halve: every
+        configuration is screened at a full run's budget instead, and the best 1/eta of them run in full.
+        """
+
+        halvings = self._halvings()
+        if halvings == 0:
+            return self._screen(configs, self._full_budget())
+        rng = np.random.default_rng(self._details.seed)
+        selected = {}
+        for s in range(halvings, -1, -1):
+            n = min(len(configs), int(math.ceil((halvings + 1) / (s + 1) * self._eta ** s)))
+            bracket = [configs[i] for i in sorted(rng.choice(len(configs), n, replace=False))]
+            for runs, config in self._successive_halving(bracket, int(math.ceil(self._full_budget() / self._eta ** s))):
+                selected[runs] = config
+        return sorted(selected.items())
+
+    def _bayes_configs(self, configs):
+        # Bayesian optimization over the index of each parameter's value (configs are ordered as their product),
+        # scoring each configuration it proposes by learning it for 1/eta of a full run
+        shape = [len(self._alphas), len(self._q_inits), len(self._epsilons), len(self._epsilon_decays),
+                 len(self._discount_factors)]
+        free = [d for d, n in enumerate(shape) if n > 1]
+        calls = min(self._bayes_calls, len(configs))
+        if not free or calls == len(configs):
+            return configs
+
+        optimizer = skopt.Optimizer([skopt.space.Integer(0, shape[d] - 1) for d in free],
+                                    random_state=self._details.seed)
+        budget = int(math.ceil(self._full_budget() / float(self._eta)))
+        scores = {}
+        for _ in range(int(math.ceil(calls / float(BAYES_BATCH)))):
+            # Batches are the same whatever the number of workers, so the same configurations are screened
+            xs = optimizer.ask(n_points=BAYES_BATCH)
+            indices = []
+            for x in xs:
+                index = [0] * len(shape)
+                for d, i in zip(free, x):
+                    index[d] = int(i)
+                indices.append(int(np.ravel_multi_index(index, shape)))
+
+            # Proposals may repeat; each configuration is only learned once
+            new = sorted(set(i for i in indices if i not in scores))
+            for i, (score, _) in zip(new, self.map_points('score_config', [(configs[i][1], budget) for i in new])):
+                scores[i] = score
+            optimizer.tell([list(x) for x in xs], [-scores[i] for i in indices])
+
+        self.log("Screened {} QL configurations by Bayesian optimization".format(len(scores)))
+        return self._best(configs, scores)
+
+    def _screen(self, configs, budget):
+        # Score every configuration at one budget
+        scores = self.map_points('score_config', [(config, budget) for _, config in configs])
+        return self._best(configs, {i: score for i, (score, _) in enumerate(scores)})
+
+    def _best(self, configs, scores):
+        # The best 1/eta of the scored configurations (by index into configs), in grid order
+        best = sorted(scores, key=lambda i: -scores[i])[:max(1, len(scores) // self._eta)]
+        return [configs[i] for i in sorted(best)]
+
+    def _log_config(self, runs, config):
+        self.log("{}/{} Processing QL with alpha {}, q_init {}, epsilon {}, epsilon_decay {},"
+                 " discount_factor {}".format(runs, self._dims(), config['alpha'], config['q_init'], config['epsilon'],
+                                              config['epsilon_decay'], config['discount_factor']))
+
+    def _snapshot_step_size(self):
+        # Only every this many episodes' policy and value are kept (see ExperimentStats)
+        return self._max_episodes / float(MAX_SNAPSHOTS)
+
+    def _pkl_file_base(self, config):
+        return os.path.join(PKL_DIR, '{}_{}_{}_{}_{}_{}_{}.pkl'.format(self._details.env_name, config['alpha'],
+                            config['q_init'], config['epsilon'], config['epsilon_decay'], config['discount_factor'],
+                            '{}'))
+
+    def _solve(self, qs, config, t, rollout_rng):
+        """
+        Run (or replay) a configuration's solver and score its policy, caching the results.
+
+        :param qs: The configuration's solver
+        :param config: Dict of the configuration's parameters
+        :param t: time.clock() when the configuration started
+        :param rollout_rng: numpy Generator for the evaluation rollouts
+        :return: Dict of the configuration's results (see _write_results)
+        """
+
+        map_desc = self._details.env.unwrapped.desc
+
+        # Only the snapshots that get saved are kept (or saved as soon as they arrive). Cached runs keep theirs, so
+        # that they can be written again on a cache hit
+        snapshot_step_size = self._snapshot_step_size()
+        pkl_file_base = self._pkl_file_base(config)
+        spill = None
+        if SPILL_SNAPSHOTS and self._run_cache is None:
+            def spill(step, actions, v):
+                self.save_snapshot(config, pkl_file_base, step, actions, v, map_desc.shape)
+        stats = self.run_solver_and_collect(qs, self.convergence_check_fn, snapshot_step_size=snapshot_step_size,
+                                            spill=spill, checkpoint=config)
+
+        optimal_policy_stats = self.run_policy_and_collect(qs, stats.optimal_policy, self._num_trials,
+                                                           rng=rollout_rng)
+
+        # We have extra stats about the episode we might want to look at later
+        results = {'stats': stats, 'episode': qs.get_stats(), 'optimal': optimal_policy_stats,
+                   'elapsed': time.clock() - t}
+        self.cache_results(config, results)
+        return results
+
+    def _write_results(self, config, results):
+        """
+        Write a configuration's results.
+
+        :param config: Dict of the configuration's parameters
+        :param results: Dict of the configuration's results (see _solve)
+        :return: The configuration's grid file row
+        """
+
+        map_desc = self._details.env.unwrapped.desc
+
+        alpha, q_init, epsilon, epsilon_decay, discount_factor = config['alpha'], config['q_init'], \
+            config['epsilon'], config['epsilon_decay'], config['discount_factor']
+
+        t = time.clock()
+        stats = results['stats']
+        snapshot_step_size = self._snapshot_step_size()
+
+        self.log("Took {} episodes".format(len(stats.steps)))
+        self.save_series(config, 'steps', stats, os.path.join(QL_DIR, '{}_{}_{}_{}_{}_{}.csv'.format(
+                         self._details.env_name, alpha, q_init, epsilon, epsilon_decay, discount_factor)))
+        self.save_snapshots(config, stats, self._pkl_file_base(config), map_desc.shape, step_size = snapshot_step_size)
+        self.output(stats.plot_policies_on_map, os.path.join(IMG_DIR, '{}_{}_{}_{}_{}_{}_{}.png'.format(self._details.env_name,
+                    alpha, q_init, epsilon, epsilon_decay, discount_factor, '{}_{}')),
+                    map_desc, self._details.env.colors(),
+                    self._details.env.directions(),
+                    'Q-Learner', 'Episode', self._details,
+                    step_size = snapshot_step_size,
+                    only_last = True)
+
+        self.save_series(config, 'episode', results['episode'], os.path.join(QL_DIR, '{}_{}_{}_{}_{}_{}_episode.csv'.format(
+                         self._details.env_name, alpha, q_init, epsilon, epsilon_decay, discount_factor)))
+
+        optimal_policy_stats = results['optimal']
+        self.log('{}'.format(optimal_policy_stats))
+        self.save_series(config, 'optimal', optimal_policy_stats, os.path.join(QL_DIR, '{}_{}_{}_{}_{}_{}_optimal.csv'.format(
+                         self._details.env_name, alpha, q_init, epsilon, epsilon_decay, discount_factor)))
+
+        # A cached configuration is timed as its solver originally took
+        return self.grid_row(config, results['elapsed'] + time.clock() - t, optimal_policy_stats)
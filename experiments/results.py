@@ -0,0 +1,263 @@
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Seconds a writer waits for another process's write to finish
+LOCK_TIMEOUT = 60
+
+GRID_COLUMNS = ['params', 'time', 'steps', 'reward_mean', 'reward_median', 'reward_min', 'reward_max', 'reward_std']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL,
+    problem TEXT NOT NULL,
+    env TEXT NOT NULL,
+    params TEXT NOT NULL,
+    time REAL,
+    steps INTEGER,
+    reward_mean REAL,
+    reward_median REAL,
+    reward_min REAL,
+    reward_max REAL,
+    reward_std REAL
+);
+CREATE INDEX IF NOT EXISTS points_problem_env ON points (problem, env);
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    problem TEXT NOT NULL,
+    env TEXT NOT NULL,
+    params TEXT NOT NULL,
+    name TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS series_key ON series (problem, env, params, name);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    problem TEXT NOT NULL,
+    env TEXT NOT NULL,
+    params TEXT NOT NULL,
+    step TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_key ON snapshots (problem, env, params, step);
+"""
+
+# The results store experiments write to and plotting reads from; None writes per grid point files instead
+_results_store = None
+
+
+def set_results_store(path):
+    """
+    Write experiment results to a store at the given path (or to per grid point CSV and pickle files with None).
+
+    :param path: The store's SQLite database file
+    :return: None
+    """
+
+    global _results_store
+    _results_store = ResultsStore(path) if path is not None else None
+
+
+def get_results_store():
+    return _results_store
+
+
+def params_key(params):
+    # Canonical JSON of a grid point's parameters, so the same point always has the same key
+    return json.dumps(params, sort_keys=True)
+
+
+def _to_blob(arrays):
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return sqlite3.Binary(buffer.getvalue())
+
+
+def _from_blob(blob):
+    with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+class ResultsStore(object):
+    """
+    Append-only store of experiment results in one SQLite database: grid points as rows, and every grid point's
+    series (one column per CSV column) and policy/value snapshots as npz blobs, all indexed by problem ('PI', 'VI',
+    'QL'), environment and parameters. Rewriting a point appends; reads return the latest version.
+
+    Any number of processes and threads may write at once (SQLite serializes them); each opens its own connection.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The SQLite database file; created if missing
+        """
+
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    def __getstate__(self):
+        # Connections stay with the process and thread that opened them
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._local = threading.local()
+
+    def _connect(self):
+        local = self._local
+        if getattr(local, 'connection', None) is None or local.pid != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.pid = os.getpid()
+        return local.connection
+
+    @staticmethod
+    def new_run():
+        """
+        A new run id; a grid's points are written under one run id, so that reading a grid never mixes runs.
+        """
+
+        return uuid.uuid4().hex
+
+    def add_points(self, run, problem, env, rows):
+        """
+        Append grid points.
+
+        :param run: The run id (see new_run)
+        :param problem: 'PI', 'VI' or 'QL'
+        :param env: The environment name
+        :param rows: List of (params, time, steps, reward_mean, reward_median, reward_min, reward_max, reward_std)
+        :return: None
+        """
+
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT INTO points (run, problem, env, params, time, steps, reward_mean, reward_median, reward_min, '
+                'reward_max, reward_std) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run, problem, env, params_key(row[0])) + tuple(_to_sql(value) for value in row[1:]) for row in rows])
+
+    def add_series(self, problem, env, params, name, columns):
+        """
+        Append one of a grid point's series, e.g. its per step stats ('steps'), evaluation trials ('optimal') or
+        episode stats ('episode').
+
+        :param columns: List of (column name, values) pairs
+        :return: None
+        """
+
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO series (problem, env, params, name, columns, data) VALUES (?, ?, ?, ?, ?, ?)',
+                (problem, env, params_key(params), name, json.dumps([column for column, _ in columns]),
+                 _to_blob({'c{}'.format(i): np.asarray(values) for i, (_, values) in enumerate(columns)})))
+
+    def add_snapshot(self, problem, env, params, step, policy, v):
+        """
+        Append a policy/value snapshot of a grid point.
+
+        :param step: The step of the snapshot, or 'Last'
+        :param policy: The map shaped array of actions
+        :param v: The map shaped value function
+        :return: None
+        """
+
+        with self._connect() as connection:
+            connection.execute('INSERT INTO snapshots (problem, env, params, step, data) VALUES (?, ?, ?, ?, ?)',
+                               (problem, env, params_key(params), str(step),
+                                _to_blob({'policy': policy, 'v': v})))
+
+    def envs(self, problem):
+        """
+        The environments a problem has grid points for.
+        """
+
+        rows = self._connect().execute('SELECT DISTINCT env FROM points WHERE problem = ? ORDER BY env', (problem,))
+        return [env for env, in rows]
+
+    def grid(self, problem, env):
+        """
+        The grid of a problem and environment's latest run, as its grid CSV would read.
+
+        :return: A DataFrame with GRID_COLUMNS, in grid order
+        """
+
+        run = self.latest_run(problem, env)
+        if run is None:
+            return pd.DataFrame(columns=GRID_COLUMNS)
+        return pd.read_sql_query('SELECT {} FROM points WHERE run = ? AND problem = ? AND env = ? ORDER BY id'.format(
+            ', '.join(GRID_COLUMNS)), self._connect(), params=(run, problem, env))
+
+    def latest_run(self, problem, env):
+        """
+        The id of the latest run with grid points of a problem and environment, or None.
+        """
+
+        latest = self._connect().execute(
+            'SELECT run FROM points WHERE problem = ? AND env = ? ORDER BY id DESC LIMIT 1', (problem, env)).fetchone()
+        return latest[0] if latest is not None else None
+
+    def series(self, problem, env, params, name):
+        """
+        The latest version of one of a grid point's series.
+
+        :return: A DataFrame, or None if there is none
+        """
+
+        row = self._connect().execute(
+            'SELECT columns, data FROM series WHERE problem = ? AND env = ? AND params = ? AND name = ? '
+            'ORDER BY id DESC LIMIT 1', (problem, env, params_key(params), name)).fetchone()
+        if row is None:
+            return None
+        columns, data = json.loads(row[0]), _from_blob(row[1])
+        return pd.DataFrame({column: data['c{}'.format(i)] for i, column in enumerate(columns)}, columns=columns)
+
+    def snapshot(self, problem, env, params, step='Last'):
+        """
+        The latest version of a grid point's snapshot.
+
+        :return: A dict with the policy and v, or None if there is none
+        """
+
+        row = self._connect().execute(
+            'SELECT data FROM snapshots WHERE problem = ? AND env = ? AND params = ? AND step = ? '
+            'ORDER BY id DESC LIMIT 1', (problem, env, params_key(params), str(step))).fetchone()
+        return _from_blob(row[0]) if row is not None else None
+
+    def export_series(self, problem, env, params, name, file_name):
+        """
+        Write one of a grid point's series to a CSV file, as the experiment would have written it without a store.
+
+        :return: True if the point has the series
+        """
+
+        df = self.series(problem, env, params, name)
+        if df is None:
+            return False
+        df.to_csv(file_name, index=False)
+        return True
+
+
+def _to_sql(value):
+    # NaN (e.g. the median of an exactly scored policy) is stored as NULL
+    if isinstance(value, (float, np.floating)) and np.isnan(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,145 @@
+import functools
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import sys
+
+import numpy as np
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Most bytes the cache keeps on disk; the least recently used runs are evicted beyond it
+MAX_CACHE_BYTES = 1024 ** 3
+
+# Packages whose code shapes solver results: editing any of their files starts the cache afresh
+CODE_PACKAGES = ['solvers', 'environments']
+
+# The cache experiments reuse solver runs from; None reruns every solver
+_run_cache = None
+
+
+def set_run_cache(directory, max_bytes=MAX_CACHE_BYTES):
+    """
+    Reuse the results of solver runs whose inputs have not changed from a cache in the given directory (or stop
+    caching with None).
+
+    :param directory: Directory holding the cached runs
+    :param max_bytes: Most bytes to keep
+    :return: None
+    """
+
+    global _run_cache
+    _run_cache = RunCache(directory, max_bytes) if directory is not None else None
+
+
+def get_run_cache():
+    return _run_cache
+
+
+def mdp_hash(mdp):
+    """
+    Content hash of a compiled MDP: its transitions, rewards, start distribution and map, i.e. everything an
+    environment's map, rewards and step/wind probabilities shape.
+    """
+
+    digest = hashlib.sha1('{} {}'.format(mdp.nS, mdp.nA).encode('utf-8'))
+    arrays = [mdp.indptr, mdp.next_states, mdp.probs, mdp.rewards, mdp.dones, mdp.isd]
+    if mdp.desc is not None:
+        arrays.append(mdp.desc)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update('{}{}'.format(array.dtype.str, array.shape).encode('utf-8'))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def code_version(module_files=()):
+    """
+    Hash of the source of CODE_PACKAGES and of the given module files.
+    """
+
+    files = set(os.path.abspath(f) for f in module_files)
+    for package in CODE_PACKAGES:
+        files.update(glob.glob(os.path.join(os.path.dirname(os.path.abspath(sys.modules[package].__file__)), '*.py')))
+
+    digest = hashlib.sha1()
+    for file_name in sorted(files):
+        with open(file_name, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class RunCache(object):
+    """
+    On-disk, content addressed cache of solver run results: each entry is a pickle named after the hash of the run's
+    inputs (see BaseExperiment.run_key), so a run with the same inputs is served from it and any changed input simply
+    misses. Reading an entry marks it as used; once the cache holds more than max_bytes, the least recently used
+    entries are evicted. Any number of processes may share it.
+    """
+
+    def __init__(self, directory, max_bytes=MAX_CACHE_BYTES):
+        """
+        :param directory: Directory holding the entries; created if missing
+        :param max_bytes: Most bytes to keep
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _file_name(self, key):
+        return os.path.join(self.directory, '{}.pkl'.format(key))
+
+    def get(self, key):
+        """
+        The results cached under a key, or None.
+        """
+
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(file_name)
+            return value
+        except (IOError, OSError):
+            return None
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+            logger.warning('Ignoring unreadable cached run {}: {}'.format(file_name, e))
+            return None
+
+    def put(self, key, value):
+        """
+        Cache results under a key, then evict the least recently used entries beyond max_bytes.
+        """
+
+        file_name = self._file_name(key)
+        temp_file_name = '{}.{}.tmp'.format(file_name, os.getpid())
+        with open(temp_file_name, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file_name, file_name)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for file_name in glob.glob(os.path.join(self.directory, '*.pkl')):
+            try:
+                info = os.stat(file_name)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, file_name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,76 @@
+import logging
+import queue
+import threading
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Most pending writes before submitting blocks
+MAX_PENDING = 8
+
+
+class BackgroundWriter(object):
+    """
+    Runs output side effects (writing CSVs, results, pickles, plots) on a background thread, in the order they are
+    submitted, so the caller can carry on computing. At most max_pending writes wait at a time: submitting more blocks
+    until one is done, which bounds the memory held by pending results. An error in a write is raised by the next
+    submit or flush.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING):
+        """
+        :param max_pending: Most writes waiting to run
+        """
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='BackgroundWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                if self._error is None:
+                    fn, args, kwargs = task
+                    fn(*args, **kwargs)
+            except Exception as e:
+                logger.exception('Background write failed')
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) in the background, after everything submitted before it.
+        """
+
+        self._raise_error()
+        self._queue.put((fn, args, kwargs))
+
+    def flush(self):
+        """
+        Wait for every submitted write to finish.
+        """
+
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Finish every submitted write and stop the thread.
+        """
+
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
@@ -1,11 +1,16 @@
 import argparse
 from datetime import datetime
 import logging
+import os
 import random as rand
 import numpy as np
 
 import environments
+import environments.cache
 import experiments
+import experiments.checkpoints
+import experiments.results
+import experiments.run_cache
 from experiments import plotting
 
 # Get parameters from external file (./parameters.py) if provided
@@ -122,7 +127,8 @@ logger = logging.getLogger(__name__)
 def run_experiment(experiment_details, experiment, timing_key, verbose, timings, max_steps, num_trials, \
                    theta = None, max_episodes = None, min_episodes = None, max_episode_steps = None, \
                    min_sub_thetas = None, discounts = None, alphas = None, q_inits = None, epsilons = None, \
-                   epsilon_decays = None):
+                   epsilon_decays = None, scoring = 'rollouts', trial_tolerance = None, search = 'grid', \
+                   vectorized = False, evaluation = 'iterative'):
 
     timings[timing_key] = {}
     for details in experiment_details:
@@ -132,10 +138,16 @@ def run_experiment(experiment_details, experiment, timing_key, verbose, timings,
             exp = experiment(details, verbose=verbose, max_steps=max_steps, num_trials=num_trials,
                              max_episodes=max_episodes, min_episodes=min_episodes, max_episode_steps=max_episode_steps,
                              min_sub_thetas=min_sub_thetas, theta=theta, discounts=discounts, alphas=alphas,
-                             q_inits=q_inits, epsilons=epsilons, epsilon_decays=epsilon_decays)
-        else: # NOT Q-Learning
+                             q_inits=q_inits, epsilons=epsilons, epsilon_decays=epsilon_decays, scoring=scoring,
+                             trial_tolerance=trial_tolerance, search=search)
+        elif timing_key == 'VI': # Value Iteration
             exp = experiment(details, verbose=verbose, max_steps=max_steps, num_trials=num_trials, theta=theta,
-                             discounts=discounts)
+                             discounts=discounts, scoring=scoring, trial_tolerance=trial_tolerance,
+                             vectorized=vectorized)
+        else: # Policy Iteration
+            exp = experiment(details, verbose=verbose, max_steps=max_steps, num_trials=num_trials, theta=theta,
+                             discounts=discounts, scoring=scoring, trial_tolerance=trial_tolerance,
+                             evaluation=evaluation)
         exp.perform()
         t_d = datetime.now() - t
         timings[timing_key][details.env_name] = t_d.seconds
@@ -145,7 +157,7 @@ if __name__ == '__main__':
 
     # Parse arguments
     parser = argparse.ArgumentParser(description='Run MDP experiments')
-    parser.add_argument('--threads', type=int, default=-1, help='Number of threads (defaults to -1 for auto)')
+    parser.add_argument('--threads', type=int, default=-1, help='Number of worker processes running experiment grids (defaults to -1 for one per CPU)')
     parser.add_argument('--seed', type=int, help='A random seed to set, if desired')
     parser.add_argument('--policy', action='store_true', help='Run the Policy Iteration (PI) experiment')
     parser.add_argument('--value', action='store_true', help='Run the Value Iteration (VI) experiment')
@@ -153,17 +165,65 @@ if __name__ == '__main__':
     parser.add_argument('--all', action='store_true', help='Run all experiments')
     parser.add_argument('--plot', action='store_true', help='Plot data results')
     parser.add_argument('--verbose', action='store_true', help='If true, provide verbose output')
+    parser.add_argument('--no-cache', action='store_true', help='Build every MDP from scratch instead of using the '
+                                                                   'on-disk MDP cache (output/cache)')
+    parser.add_argument('--exact', action='store_true', help='Score each optimal policy exactly (absorbing Markov '
+                                                             'chain) instead of by running trials')
+    parser.add_argument('--trial-tolerance', type=float, help='Stop running trials of each optimal policy once the 95%% '
+                                                              'confidence interval of its mean reward is narrower than '
+                                                              'this (at most the configured number of trials)')
+    parser.add_argument('--no-store', action='store_true', help='Write per grid point CSV and pickle files instead of '
+                                                                'the results store (output/results.sqlite)')
+    parser.add_argument('--resume', action='store_true', help='Pick up where an interrupted run of the same command '
+                                                              'stopped: skip grid points already in the grid files '
+                                                              'and resume solvers from their checkpoints '
+                                                              '(output/checkpoints); needs the run\'s --seed')
+    parser.add_argument('--no-run-cache', action='store_true', help='Rerun every solver instead of reusing the results '
+                                                                    'of runs with the same environment, parameters, '
+                                                                    'seed and code (output/run_cache); only runs with '
+                                                                    'a --seed are cached')
+    parser.add_argument('--pi-evaluation', choices=['iterative', 'direct', 'gmres', 'bicgstab'], default='iterative',
+                        help='How Policy Iteration evaluates each policy: sweeps until theta (iterative), or an exact '
+                             'solve of its linear system by sparse LU (direct) or a Krylov method (gmres, bicgstab)')
+    parser.add_argument('--vi-vectorized', action='store_true', help='Back up all states at once in each Value '
+                                                                     'Iteration step (synchronous/Jacobi: cheaper steps, '
+                                                                     'but more of them and different per step values '
+                                                                     'than the default in-place sweep)')
+    parser.add_argument('--ql-search', choices=['grid', 'halving', 'hyperband', 'bayes'], default='grid',
+                        help='How the Q-Learner searches its parameters: every combination (grid), or only the best '
+                             'of them in full after screening them briefly by successive halving, Hyperband or '
+                             'Bayesian optimization (bayes, needs scikit-optimize)')
     args = parser.parse_args()
+    if args.resume and args.seed is None:
+        # Grid points draw from streams derived from the seed; a new one would not pick up where the last run stopped
+        parser.error('--resume needs the --seed of the run it resumes')
     verbose = args.verbose
     threads = args.threads
+    scoring = 'exact' if args.exact else 'rollouts'
 
-    # Set random seed
+    # Set random seed; every experiment grid point derives its own random streams from it
     seed = args.seed
     if seed is None:
         seed = np.random.randint(0, (2 ** 32) - 1)
-        logger.info("Using seed {}".format(seed))
-        np.random.seed(seed)
-        rand.seed(seed)
+    logger.info("Using seed {}".format(seed))
+    np.random.seed(seed)
+    rand.seed(seed)
+
+    # Keep results in one store rather than per grid point files
+    if not args.no_store:
+        experiments.results.set_results_store(os.path.join('output', 'results.sqlite'))
+
+    # Checkpoint long running solvers, so an interrupted run can be resumed
+    experiments.checkpoints.set_checkpoint_dir(os.path.join('output', 'checkpoints'), resume=args.resume)
+
+    # Reuse transition models built by earlier runs
+    if not args.no_cache:
+        environments.cache.set_cache_dir(os.path.join('output', 'cache'))
+
+    # Reuse the results of solver runs whose inputs have not changed
+    # (a seed drawn at random is never asked for again, so its runs would only crowd out others)
+    if not args.no_run_cache and args.seed is not None:
+        experiments.run_cache.set_run_cache(os.path.join('output', 'run_cache'))
 
     logger.info("Creating MDPs")
     logger.info("----------")
@@ -219,13 +279,15 @@ if __name__ == '__main__':
     if args.policy or args.all:
         print('\n\n')
         run_experiment(experiment_details, experiments.PolicyIterationExperiment, 'PI', verbose, timings, \
-                       MAX_STEPS['pi'], NUM_TRIALS['pi'], theta=PI_THETA, discounts=PI_DISCOUNTS)
+                       MAX_STEPS['pi'], NUM_TRIALS['pi'], theta=PI_THETA, discounts=PI_DISCOUNTS, scoring=scoring, \
+                       trial_tolerance=args.trial_tolerance, evaluation=args.pi_evaluation)
 
     # Run Value Iteration (VI) experiment
     if args.value or args.all:
         print('\n\n')
         run_experiment(experiment_details, experiments.ValueIterationExperiment, 'VI', verbose, timings, \
-                       MAX_STEPS['vi'], NUM_TRIALS['vi'], theta=VI_THETA, discounts=VI_DISCOUNTS)
+                       MAX_STEPS['vi'], NUM_TRIALS['vi'], theta=VI_THETA, discounts=VI_DISCOUNTS, scoring=scoring, \
+                       trial_tolerance=args.trial_tolerance, vectorized=args.vi_vectorized)
 
     # Run Q-Learning (QL) experiment
     if args.ql or args.all:
@@ -234,7 +296,8 @@ if __name__ == '__main__':
                        NUM_TRIALS['ql'], max_episodes=QL_MAX_EPISODES, max_episode_steps=QL_MAX_EPISODE_STEPS, \
                        min_episodes = QL_MIN_EPISODES, min_sub_thetas=QL_MIN_SUB_THETAS, theta=QL_THETA, \
                        discounts=QL_DISCOUNTS, alphas=QL_ALPHAS, q_inits=QL_Q_INITS, epsilons=QL_EPSILONS, \
-                       epsilon_decays=QL_EPSILON_DECAYS)
+                       epsilon_decays=QL_EPSILON_DECAYS, scoring=scoring, \
+                       trial_tolerance=args.trial_tolerance, search=args.ql_search)
 
     # Generate plots
     if args.plot:
@@ -242,7 +305,7 @@ if __name__ == '__main__':
         if verbose:
             logger.info("----------")
         logger.info("Plotting results")
-        plotting.plot_results(envs)
+        plotting.plot_results(envs, processes=threads)
 
     # Output timing information
     print('\n\n')
@@ -6,7 +6,7 @@ declare -a linuxPackages=("python3-pip=9.0.1-2.3~ubuntu1"
                           "python3-tk=3.6.7-1~18.04"
                           "--user virtualenv")
 declare -a pythonModules=("gym==0.12.1"
-                          "numpy==1.15.1"
+                          "numpy==1.17.5"
                           "scipy==1.1.0"
                           "scikit-learn==0.19.2"
                           "pandas==0.23.4"
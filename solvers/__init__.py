@@ -1,10 +1,14 @@
 
 from .base import *
+from .batched_q_learning import *
+from .evaluation import *
+from .grid import *
+from .mdp import *
 
 from .policy_iteration import *
 from .q_learning import *
 from .value_iteration import *
 
 
-__all__ = ['base', 'policy_iteration', 'q_learning', 'value_iteration']
+__all__ = ['base', 'batched_q_learning', 'evaluation', 'grid', 'mdp', 'policy_iteration', 'q_learning', 'value_iteration']
 
@@ -4,6 +4,12 @@ import logging
 import numpy as np
 
 from abc import ABC, abstractmethod
+from scipy import sparse
+from scipy.sparse import linalg
+
+from .evaluation import exact_policy_evaluation
+from .mdp import CompiledMDP, compile_mdp
+from environments.vector import VectorEnv
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,6 +25,10 @@ class EpisodeStats(object):
         self.episode_rewards = np.zeros(num_episodes)
         self.episode_deltas = np.zeros(num_episodes)
 
+    def columns(self):
+        return [('episode', range(self.num_episodes)), ('length', self.episode_lengths), ('time', self.episode_times),
+                ('reward', self.episode_rewards), ('delta', self.episode_deltas)]
+
     def to_csv(self, file_name):
         with open(file_name, 'w') as f:
             f.write("episode,length,time,reward,delta\n")
@@ -40,6 +50,7 @@ def one_step_lookahead(env, discount_factor, state, v):
     Helper function to calculate the value for all action in a given state.
 
     Args:
+        env: The environment, or a CompiledMDP built from it
         state: The state to consider (int)
         v: The value to use as an estimator, Vector of length env.nS
 
@@ -47,6 +58,9 @@ def one_step_lookahead(env, discount_factor, state, v):
         A vector of length env.nA containing the expected value of each action.
     """
 
+    if isinstance(env, CompiledMDP):
+        return env.lookahead(state, v, discount_factor)
+
     A = np.zeros(env.nA)
     for a in range(env.nA):
         for prob, next_state, reward, done in env.P[state][a]:
@@ -56,8 +70,12 @@ def one_step_lookahead(env, discount_factor, state, v):
 
 class BaseSolver(ABC):
 
-    def __init__(self, verbose=False):
+    # Attributes holding a solver's progress (see get_state); empty if the solver cannot be checkpointed
+    STATE = ()
+
+    def __init__(self, verbose=False, mdp=None):
         self._verbose = verbose
+        self._mdp = mdp
 
     @abstractmethod
     def step(self):
@@ -83,8 +101,26 @@ class BaseSolver(ABC):
     def get_environment(self):
         pass
 
+    def get_mdp(self):
+        return self._mdp
+
+    def get_state(self):
+        """
+        The solver's progress: its STATE attributes (value function, policy, counters, random state...), to checkpoint
+        a long run. set_state resumes it on a solver built with the same arguments. The state shares arrays with the
+        solver, so it must be saved before the solver steps on.
+
+        :return: Dict of attribute name to value
+        """
+
+        return {name: getattr(self, name) for name in self.STATE}
+
+    def set_state(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     # Adapted from https://github.com/dennybritz/reinforcement-learning/blob/master/DP/Policy%20Iteration%20Solution.ipynb
-    def evaluate_policy(self, policy, discount_factor=1.0, max_steps=None, theta=0.00001):
+    def evaluate_policy(self, policy, discount_factor=1.0, max_steps=None, theta=0.00001, method='iterative', V=None):
         """
         Evaluate a policy given an environment and a full description of the environment's dynamics.
 
@@ -93,11 +129,36 @@ class BaseSolver(ABC):
             max_steps: If not none, the number of iterations to run
             theta: We stop evaluation once our value function change is less than theta for all states.
             discount_factor: Gamma discount factor.
+            method: 'iterative' for sweeps until theta, or solve the policy's linear system exactly with 'direct'
+                (sparse LU factorization), 'gmres' or 'bicgstab' (Krylov methods, for very large maps). With a compiled
+                MDP, the iterative sweeps are synchronous (Jacobi) rather than in place (Gauss-Seidel), so they take
+                more sweeps and their values differ slightly from the dict-based evaluation's
+            V: If not none, the value function to start from (e.g. the previous policy's values) instead of all 0
 
         Returns:
             Vector of length env.nS representing the value function.
         """
 
+        if method != 'iterative':
+            return self._solve_policy(policy, discount_factor, theta, method, V)
+
+        mdp = self.get_mdp()
+        if mdp is not None:
+            # Synchronous (Jacobi) sweeps over the compiled arrays: every state is backed up from the previous sweep's
+            # values, where the dict-based evaluation below updates V in place (Gauss-Seidel). The stopping rule is the
+            # same, but it takes more sweeps to get within theta, and the values differ slightly (by about theta, so
+            # the improved policy can differ on near ties)
+            V = np.zeros(mdp.nS) if V is None else np.array(V, dtype=np.float64)
+            steps = 0
+            while max_steps is None or steps < max_steps:
+                new_V = mdp.policy_backup(V, policy, discount_factor)
+                delta = np.max(np.abs(new_V - V))
+                V = new_V
+                steps += 1
+                if delta < theta:
+                    break
+            return V
+
         env = self.get_environment()
 
         # Get start positions
@@ -121,7 +182,10 @@ class BaseSolver(ABC):
                     break
 
         # Get values
-        V = np.zeros(env.nS) # Start with a random (all 0) value function
+        if V is None:
+            V = np.zeros(env.nS) # Start with a random (all 0) value function
+        else:
+            V = np.array(V, dtype=np.float64)
         steps = 0
         while max_steps is None or steps < max_steps:
             delta = 0
@@ -162,6 +226,25 @@ class BaseSolver(ABC):
 
         return np.array(V)
 
+    def _solve_policy(self, policy, discount_factor, theta, method, V=None):
+
+        mdp = self.get_mdp()
+        if mdp is None:
+            mdp = compile_mdp(self.get_environment())
+        A, b = mdp.policy_system(policy, discount_factor)
+
+        if method == 'direct':
+            if not sparse.issparse(A):
+                raise ValueError("Direct policy evaluation needs an explicit matrix; use 'gmres' or 'bicgstab'")
+            return linalg.splu(A.tocsc()).solve(b)
+        elif method in ('gmres', 'bicgstab'):
+            krylov = linalg.gmres if method == 'gmres' else linalg.bicgstab
+            V, info = krylov(A, b, x0=V, tol=theta)
+            if info != 0:
+                logger.warning('{} policy evaluation did not converge (info: {})'.format(method, info))
+            return V
+        raise ValueError('Unknown policy evaluation method: {}'.format(method))
+
     def render_policy(self, policy):
 
         env = self.get_environment()
@@ -173,13 +256,14 @@ class BaseSolver(ABC):
                 print(directions[policy[row, col]] + ' ', end="")
             print("")
 
-    def run_policy(self, policy, max_steps=None, render_during=False):
+    def run_policy(self, policy, max_steps=None, render_during=False, rng=None):
         """
         Run through the given policy. This will reset the solver's environment before running.
 
         :param policy: The policy to run
         :param max_steps: The total number of steps to run. This helps prevent the agent getting "stuck"
         :param render_during: If true, render the env to stdout at each step
+        :param rng: If not none, the numpy Generator the environment draws its transitions from
         :return: An ndarray of rewards for each step
         """
 
@@ -189,6 +273,8 @@ class BaseSolver(ABC):
 
         # Clone the environment to get a fresh one
         env = self.get_environment().new_instance()
+        if rng is not None:
+            env.seed(rng)
         state = env.reset()
 
         done = False
@@ -207,6 +293,35 @@ class BaseSolver(ABC):
 
         return np.array(rewards)
 
+    def run_policies(self, policy, num_trials, max_steps, rng=None):
+        """
+        Run through the given policy num_trials times at once, on a vectorized copy of the solver's environment.
+
+        :param policy: The policy to run
+        :param num_trials: The number of trials
+        :param max_steps: The most steps per trial
+        :param rng: If not none, the numpy Generator to draw transitions from (else the environment's RandomState)
+        :return: An ndarray with the mean reward per step of each trial, as np.mean(run_policy(...)) would give
+        """
+
+        vector_env = VectorEnv(self.get_environment(), rng=rng)
+        total_rewards, lengths = vector_env.rollout(np.argmax(policy, axis=1), num_trials, max_steps)
+        return total_rewards / lengths
+
+    def evaluate_policy_exactly(self, policy, max_steps=None):
+        """
+        Evaluate the given policy exactly, without running it (see exact_policy_evaluation).
+
+        :param policy: The policy to evaluate
+        :param max_steps: The most steps per episode, or None for no limit
+        :return: A PolicyEvaluation
+        """
+
+        mdp = self.get_mdp()
+        if mdp is None:
+            mdp = compile_mdp(self.get_environment())
+        return exact_policy_evaluation(mdp, policy, max_steps)
+
     def log(self, msg, *args):
         """
         If the learner has verbose set to true, log the message with the given parameters using string.format
@@ -0,0 +1,298 @@
+import time
+import numpy as np
+
+from .base import BaseSolver, EpisodeStats
+from .q_learning import initial_q, RANDOM_BLOCK_SIZE
+from environments.vector import VectorEnv
+
+
+class BatchedQLearningSolver(object):
+    """
+    Q-learning for many hyperparameter configurations at once.
+
+    The Q tables of all configurations are stacked in one configs x nS x nA array and every configuration runs its own
+    episodes, all advanced in lockstep: each tick takes one epsilon-greedy step in every configuration that is still
+    learning, with a single vectorized environment step and TD update. A configuration stops once it converges (same
+    rule as QLearningSolver) or has run max_runs episodes; the others carry on. Every configuration draws from its own
+    random stream in the same order as the QLearningSolver fast kernel, so given the same Generator it learns exactly
+    what a QLearningSolver would, whatever else is in the batch.
+
+    run() returns one RecordedQLearningSolver per configuration, which replays that configuration's episodes through
+    the usual solver interface (step, has_converged, get_stats, run_policy, ...). With a snapshot_step_size, only the
+    policies and values of the episodes ExperimentStats keeps (see ExperimentStats.add) and of the last episode are
+    recorded, so the recordings take memory in the number of snapshots rather than of episodes.
+    """
+
+    def __init__(self, env, configs, max_episodes, min_episodes, max_steps_per_episode=500, theta=0.0001,
+                 min_consecutive_sub_theta_episodes=10, max_runs=None, verbose=False, rngs=None,
+                 snapshot_step_size=None):
+        """
+        :param env: The environment
+        :param configs: List of dicts with the alpha, q_init, epsilon, epsilon_decay and discount_factor of each
+            configuration
+        :param max_runs: If not none, the most episodes to run per configuration (e.g. the experiment's step limit)
+        :param rngs: One numpy Generator per configuration; defaults to independent ones seeded from np.random
+        :param snapshot_step_size: If not none, record the policy and value of every episode that is a multiple of
+            this (counting from 0) and of the last episode only; otherwise of every episode
+        """
+
+        if rngs is None:
+            rngs = [np.random.default_rng(seed)
+                    for seed in np.random.SeedSequence(np.random.randint(0, 2 ** 31 - 1)).spawn(len(configs))]
+
+        self._env = env.unwrapped
+        self._configs = configs
+        self._max_episodes = max_episodes
+        self._min_episodes = min_episodes
+        self._max_steps_per_episode = max_steps_per_episode
+        self._theta = theta
+        self._min_consecutive_sub_theta_episodes = min_consecutive_sub_theta_episodes
+        self._max_runs = max_runs
+        self._verbose = verbose
+        self._rngs = rngs
+        self._snapshot_step_size = snapshot_step_size
+
+    def run(self, state=None, checkpoint=None, checkpoint_interval=None):
+        """
+        Learn every configuration until it converges.
+
+        :param state: The run's state as last handed to checkpoint by an interrupted run of the same batch, to resume
+            it from; None starts afresh
+        :param checkpoint: If not none, function taking the run's state (stacked Q tables, counters, random streams
+            and recordings so far) every checkpoint_interval seconds
+        :param checkpoint_interval: Seconds between checkpoints
+        :return: A list with a RecordedQLearningSolver per configuration
+        """
+
+        env = self._env
+        nS, nA = env.nS, env.nA
+        n = len(self._configs)
+        configs = np.arange(n)
+
+        # Per configuration hyperparameters and learner state
+        Q = np.stack([initial_q(c['q_init'], nS, nA, rng=rng) for c, rng in zip(self._configs, self._rngs)])
+        alphas = np.array([c['alpha'] for c in self._configs], dtype=np.float64)
+        discount_factors = np.array([c['discount_factor'] for c in self._configs], dtype=np.float64)
+        epsilons = np.array([c['epsilon'] for c in self._configs], dtype=np.float64)
+        epsilon_decays = np.array([c['epsilon_decay'] for c in self._configs], dtype=np.float64)
+        episodes = np.zeros(n, dtype=np.int64)
+        consecutive_sub_theta_episodes = np.zeros(n, dtype=np.int64)
+        learning = np.ones(n, dtype=bool)
+
+        # Per configuration state of the current episode
+        vector_env = VectorEnv(env)
+        random_blocks = np.empty((n, RANDOM_BLOCK_SIZE))
+        random_index = np.full(n, RANDOM_BLOCK_SIZE)
+
+        def next_random(lanes):
+            # Next uniform of each given configuration's stream, drawn in blocks like the QLearningSolver fast kernel
+            for c in lanes[random_index[lanes] == RANDOM_BLOCK_SIZE]:
+                random_blocks[c] = self._rngs[c].random(RANDOM_BLOCK_SIZE)
+                random_index[c] = 0
+            u = random_blocks[lanes, random_index[lanes]]
+            random_index[lanes] += 1
+            return u
+
+        states = np.searchsorted(vector_env.cum_isd, next_random(configs), side='right')
+        total_rewards = np.zeros(n)
+        episode_steps = np.zeros(n, dtype=np.int64)
+        td_deltas = np.zeros(n)
+        episode_times = np.zeros(n)
+
+        records = [[] for _ in configs]
+        episode_stats = [EpisodeStats(self._max_episodes) for _ in configs]
+        action_dtype = np.min_scalar_type(nA - 1)
+
+        if state is not None:
+            Q, epsilons, episodes, consecutive_sub_theta_episodes, learning = state['Q'], state['epsilons'], \
+                state['episodes'], state['consecutive_sub_theta_episodes'], state['learning']
+            random_blocks[:], random_index[:] = state['random_blocks'], state['random_index']
+            for rng, rng_state in zip(self._rngs, state['rngs']):
+                rng.bit_generator.state = rng_state
+            states, total_rewards, episode_steps, td_deltas, episode_times = state['states'], \
+                state['total_rewards'], state['episode_steps'], state['td_deltas'], state['episode_times']
+            records, episode_stats = state['records'], state['episode_stats']
+
+        # Q as one (configs * nS) x nA table: configuration c's row for state s is c * nS + s
+        flat_Q = Q.reshape(n * nS, nA)
+
+        last_checkpoint = time.time()
+        active = None
+        while learning.any():
+            # Checkpoints are taken between ticks, when every array is consistent
+            if checkpoint is not None and time.time() - last_checkpoint >= checkpoint_interval:
+                checkpoint({
+                    'Q': Q,
+                    'epsilons': epsilons,
+                    'episodes': episodes,
+                    'consecutive_sub_theta_episodes': consecutive_sub_theta_episodes,
+                    'learning': learning,
+                    'random_blocks': random_blocks,
+                    'random_index': random_index,
+                    'rngs': [rng.bit_generator.state for rng in self._rngs],
+                    'states': states,
+                    'total_rewards': total_rewards,
+                    'episode_steps': episode_steps,
+                    'td_deltas': td_deltas,
+                    'episode_times': episode_times,
+                    'records': records,
+                    'episode_stats': episode_stats,
+                })
+                last_checkpoint = time.time()
+
+            tick_start = time.clock()
+
+            # Gather the hyperparameters of the configurations that are still learning only when that set changes
+            if active is None:
+                active = configs[learning]
+                lanes = np.arange(len(active))
+                row_offsets = active * nS
+                active_alphas = alphas[active]
+                active_discount_factors = discount_factors[active]
+                active_epsilon_decays = epsilon_decays[active]
+
+            s = states[active]
+            rows = row_offsets + s
+
+            # Epsilon-greedy actions: explore with probability epsilon, uniformly over all actions
+            q_rows = flat_Q[rows]
+            u = next_random(active)
+            epsilon = epsilons[active]
+            explore = u < epsilon
+            actions = q_rows.argmax(axis=1)
+            actions[explore] = np.minimum((u[explore] / epsilon[explore] * nA).astype(np.int64), nA - 1)
+
+            next_states, rewards, dones = vector_env.sample(s, actions, next_random(active))
+
+            # TD updates; every configuration updates a single entry of its own table
+            td_delta = rewards + active_discount_factors * flat_Q[row_offsets + next_states].max(axis=1) \
+                - q_rows[lanes, actions]
+            flat_Q[rows, actions] += active_alphas * td_delta
+            epsilons[active] = epsilon - epsilon * active_epsilon_decays
+
+            states[active] = next_states
+            total_rewards[active] += rewards
+            episode_steps[active] += 1
+            td_deltas[active] = td_delta
+
+            # The tick's time is shared by the configurations that took part in it
+            episode_times[active] += (time.clock() - tick_start) / len(active)
+
+            ended = active[dones | (episode_steps[active] > self._max_steps_per_episode)]
+            for c in ended:
+                if self._end_episode(c, Q[c], alphas[c], total_rewards[c], episode_steps[c], td_deltas[c],
+                                     episode_times[c], episodes, consecutive_sub_theta_episodes, records[c],
+                                     episode_stats[c], action_dtype):
+                    learning[c] = False
+                    active = None
+            if len(ended) > 0:
+                restarted = ended[learning[ended]]
+                states[restarted] = np.searchsorted(vector_env.cum_isd, next_random(restarted), side='right')
+                total_rewards[ended] = 0
+                episode_steps[ended] = 0
+                episode_times[ended] = 0
+
+        return [RecordedQLearningSolver(self._env, records[c], episode_stats[c], Q[c], self._verbose)
+                for c in configs]
+
+    def _end_episode(self, c, q, alpha, total_reward, steps, td_delta, episode_time, episodes,
+                     consecutive_sub_theta_episodes, records, stats, action_dtype):
+
+        last_delta = abs(alpha * td_delta)
+        if last_delta < self._theta:
+            consecutive_sub_theta_episodes[c] += 1
+        else:
+            consecutive_sub_theta_episodes[c] = 0
+
+        if episodes[c] < stats.num_episodes:
+            stats.episode_rewards[episodes[c]] = total_reward
+            stats.episode_lengths[episodes[c]] = steps - 1
+            stats.episode_times[episodes[c]] = episode_time
+            stats.episode_deltas[episodes[c]] = td_delta
+        episodes[c] += 1
+
+        # The policy and value are only recorded where they are kept
+        converged = self._converged(episodes[c], consecutive_sub_theta_episodes[c])
+        finished = self._finished(episodes[c], consecutive_sub_theta_episodes[c])
+        actions, v = None, None
+        if finished or self._snapshot_step_size is None or (episodes[c] - 1) % self._snapshot_step_size == 0:
+            actions, v = q.argmax(axis=1).astype(action_dtype), q.max(axis=1)
+        records.append((actions, v, int(episodes[c]), episode_time, total_reward / steps, last_delta, converged))
+        return finished
+
+    def _converged(self, episodes, consecutive_sub_theta_episodes):
+
+        # Same rule as QLearningSolver.has_converged
+        return (episodes >= self._min_episodes and
+                consecutive_sub_theta_episodes >= self._min_consecutive_sub_theta_episodes) \
+            or episodes > self._max_episodes
+
+    def _finished(self, episodes, consecutive_sub_theta_episodes):
+
+        return self._converged(episodes, consecutive_sub_theta_episodes) or \
+            (self._max_runs is not None and episodes >= self._max_runs)
+
+
+class RecordedQLearningSolver(BaseSolver):
+    """
+    One configuration of a BatchedQLearningSolver run: step() replays its recorded episodes in order, returning what
+    QLearningSolver.step would have returned after each of them, except that the policy and value are None on the
+    episodes whose policy and value were not recorded.
+    """
+
+    def __init__(self, env, records, stats, Q, verbose=False):
+        """
+        :param records: Per episode (greedy actions, values, steps, step time, reward, delta, converged) tuples; the
+            actions and values may be None
+        :param stats: The configuration's EpisodeStats
+        :param Q: The configuration's final Q table
+        """
+
+        self._env = env
+        self._records = records
+        self._stats = stats
+        self._Q = Q
+        self._index = 0
+
+        super(RecordedQLearningSolver, self).__init__(verbose)
+
+    def step(self):
+
+        actions, v, steps, step_time, reward, delta, converged = self._records[self._index]
+        self._index += 1
+        policy = self._one_hot(actions) if actions is not None else None
+        return policy, v, steps, step_time, reward, delta, converged
+
+    def reset(self):
+        self._index = 0
+
+    def has_converged(self):
+        return self._index > 0 and self._records[self._index - 1][-1]
+
+    def get_convergence(self):
+        return self._records[self._index - 1][5] if self._index > 0 else 0
+
+    def run_until_converged(self):
+        while not self.has_converged() and self._index < len(self._records):
+            self.step()
+
+    def get_environment(self):
+        return self._env
+
+    def get_stats(self):
+        return self._stats
+
+    def get_q(self):
+        return self._Q
+
+    def get_policy(self):
+        return self._one_hot(self._Q.argmax(axis=1))
+
+    def get_value(self):
+        return self._Q.max(axis=1)
+
+    def _one_hot(self, actions):
+
+        policy = np.zeros(self._Q.shape)
+        policy[np.arange(len(actions)), actions] = 1.0
+        return policy
@@ -0,0 +1,186 @@
+import numpy as np
+
+from scipy import sparse
+from scipy.sparse import linalg
+
+
+# Stop the finite horizon recursion once less than this much probability is still in an episode
+MIN_RUNNING_PROBABILITY = 1e-15
+
+
+class PolicyEvaluation(object):
+    """
+    Exact statistics of the episodes a deterministic policy runs, from the environment's initial state distribution.
+    """
+
+    def __init__(self, expected_return, expected_length, absorption, reward_mean=np.nan, reward_std=np.nan):
+        """
+        :param expected_return: Expected total (undiscounted) reward of an episode
+        :param expected_length: Expected number of steps of an episode
+        :param absorption: Dict of the probability that an episode ends in each kind of cell ('G', 'H', ...);
+            'running' is the probability that it is cut off by the step limit
+        :param reward_mean: Expected mean reward per step of an episode (what a policy rollout reports)
+        :param reward_std: Standard deviation of the mean reward per step of an episode
+        """
+
+        self.expected_return = expected_return
+        self.expected_length = expected_length
+        self.absorption = absorption
+        self.reward_mean = reward_mean
+        self.reward_std = reward_std
+
+    def __str__(self):
+        return 'expected_return: {}, expected_length: {}, absorption: {}, reward_mean: {}, reward_std: {}'.format(
+            self.expected_return,
+            self.expected_length,
+            self.absorption,
+            self.reward_mean,
+            self.reward_std
+        )
+
+
+def exact_policy_evaluation(mdp, policy, max_steps=None):
+    """
+    Evaluate a policy exactly by treating it as an absorbing Markov chain: episodes end on transitions flagged done.
+    With max_steps, episodes are also cut off after max_steps steps, as in a rollout, and a finite horizon recursion
+    gives the exact distribution moments of the rollout statistics. Without, the expected return, length and
+    absorption probabilities come from sparse linear solves. If an episode may run forever, its expected return is
+    undefined (nan), its expected length infinite and the 'running' absorption the probability that it never ends.
+
+    :param mdp: The environment's CompiledMDP
+    :param policy: The nS x nA policy to evaluate; each state takes its most likely action
+    :param max_steps: The most steps per episode, or None for no limit
+    :return: A PolicyEvaluation
+    """
+
+    actions = np.argmax(policy, axis=1)
+    pairs = np.arange(mdp.nS) * mdp.nA + actions
+    starts, ends = mdp.indptr[pairs], mdp.indptr[pairs + 1]
+    counts = ends - starts
+    outcomes = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    states = np.repeat(np.arange(mdp.nS), counts)
+
+    # Outcomes that cannot happen (e.g. slips of a certain step) are no transitions at all
+    outcomes, states = outcomes[mdp.probs[outcomes] > 0], states[mdp.probs[outcomes] > 0]
+
+    next_states = mdp.next_states[outcomes]
+    probs = mdp.probs[outcomes]
+    rewards = mdp.rewards[outcomes]
+    dones = mdp.dones[outcomes]
+
+    # Moments of the reward of every state's step, split by whether the episode goes on or ends
+    def going_on(weights):
+        return sparse.csr_matrix((weights[~dones], (states[~dones], next_states[~dones])), shape=(mdp.nS, mdp.nS))
+
+    def ending(weights):
+        return np.bincount(states[dones], weights=weights[dones], minlength=mdp.nS)
+
+    # Which kind of cell each ending transition lands in
+    kinds = np.full(len(outcomes), b'?', dtype='c')
+    if mdp.desc is not None:
+        kinds = mdp.desc.ravel()[next_states]
+    end_kinds = {kind.decode('utf-8'): ending(probs * (kinds == kind)) for kind in np.unique(kinds[dones])}
+
+    if max_steps is None:
+        return _absorbing_chain(mdp, going_on(probs), ending(probs * rewards) + going_on(probs * rewards).dot(
+            np.ones(mdp.nS)), end_kinds)
+
+    return _finite_horizon(mdp, max_steps, [going_on(probs), going_on(probs * rewards),
+                                            going_on(probs * rewards ** 2)],
+                           [ending(probs), ending(probs * rewards), ending(probs * rewards ** 2)], end_kinds)
+
+
+def _absorbing_chain(mdp, transient, step_rewards, end_kinds):
+
+    # States from which an episode can end: those with an ending transition, and the states leading to them
+    ending = np.zeros(mdp.nS)
+    for p in end_kinds.values():
+        ending += p
+    reaching = ending > 0
+    reverse = transient.T.tocsr()
+    frontier = np.flatnonzero(reaching)
+    while len(frontier) > 0:
+        previous = np.unique(reverse[frontier].indices)
+        frontier = previous[~reaching[previous]]
+        reaching[frontier] = True
+
+    # States from which an episode surely ends: those that can, with no way into states that might run forever
+    ends = reaching.copy()
+    while True:
+        escaping = ends & (transient.dot((~ends).astype(np.float64)) > 0)
+        if not escaping.any():
+            break
+        ends[escaping] = False
+
+    start = mdp.isd
+    if np.any(start[~ends] > 0):
+        # Episodes may run forever; the probability that they end somewhere is still finite
+        absorption = _solve(transient, reaching, start, end_kinds)
+        absorption['running'] = max(1.0 - sum(absorption.values()), 0.0)
+        return PolicyEvaluation(np.nan, np.inf, absorption)
+
+    # (I - Q) x = b is regular on the states where episodes surely end
+    vectors = dict(end_kinds)
+    vectors['return'] = step_rewards
+    vectors['length'] = np.ones(mdp.nS)
+    solved = _solve(transient, ends, start, vectors)
+    absorption = {kind: solved[kind] for kind in end_kinds}
+    absorption['running'] = 0.0
+
+    return PolicyEvaluation(solved['return'], solved['length'], absorption)
+
+
+def _solve(transient, states, start, vectors):
+
+    # Expectations from the start distribution of (I - Q)^-1 b for each vector b, on a subset of the states
+    idx = np.flatnonzero(states)
+    if len(idx) == 0:
+        return {name: 0.0 for name in vectors}
+    lu = linalg.splu((sparse.identity(len(idx)) - transient[idx][:, idx]).tocsc())
+    return {name: start[idx].dot(lu.solve(b[idx])) for name, b in vectors.items()}
+
+
+def _finite_horizon(mdp, max_steps, going_on, ending, end_kinds):
+
+    # Forward recursion over steps of the probability of still running in each state (m) and the expected reward
+    # (g) and squared reward (h) so far on those paths; per step mean reward moments accumulate as episodes end
+    P, PR, PR2 = going_on
+    end_p, end_pr, end_pr2 = ending
+    PT, PRT, PR2T = P.T.tocsr(), PR.T.tocsr(), PR2.T.tocsr()
+
+    m = np.asarray(mdp.isd, dtype=np.float64)
+    g = np.zeros(mdp.nS)
+    h = np.zeros(mdp.nS)
+    expected_return = 0.0
+    expected_length = 0.0
+    mean_sum = 0.0
+    square_sum = 0.0
+    absorption = {kind: 0.0 for kind in end_kinds}
+
+    length = 0
+    while length < max_steps and m.sum() >= MIN_RUNNING_PROBABILITY:
+        length += 1
+
+        ended_m = m.dot(end_p)
+        ended_g = g.dot(end_p) + m.dot(end_pr)
+        ended_h = h.dot(end_p) + 2 * g.dot(end_pr) + m.dot(end_pr2)
+        expected_return += ended_g
+        expected_length += length * ended_m
+        mean_sum += ended_g / length
+        square_sum += ended_h / length ** 2
+        for kind, p in end_kinds.items():
+            absorption[kind] += m.dot(p)
+
+        m, g, h = PT.dot(m), PT.dot(g) + PRT.dot(m), PT.dot(h) + 2 * PRT.dot(g) + PR2T.dot(m)
+
+    # Episodes still running are cut off
+    running = m.sum()
+    expected_return += g.sum()
+    expected_length += length * running
+    if length > 0:
+        mean_sum += g.sum() / length
+        square_sum += h.sum() / length ** 2
+    absorption['running'] = running
+
+    return PolicyEvaluation(expected_return, expected_length, absorption, reward_mean=mean_sum,
+                            reward_std=np.sqrt(max(square_sum - mean_sum ** 2, 0.0)))
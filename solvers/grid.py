@@ -0,0 +1,191 @@
+import numpy as np
+
+from scipy.sparse import linalg
+
+
+# Moves (row, col) of each action, in each environment's action order
+LAKE_MOVES = [(0, -1), (1, 0), (0, 1), (-1, 0)]  # left, down, right, up
+CLIFF_MOVES = [(-1, 0), (0, 1), (1, 0), (0, -1)]  # up, right, down, left
+
+
+def _shift(x, dr, dc):
+    """
+    Gather x from a shifted grid: y[i, j] = x[i + dr, j + dc], with the target clipped to the grid (i.e. moving into a
+    wall leaves the agent where it is).
+
+    :param x: 2-D array
+    :param dr: Row offset; an int, or an array shaped like x for cell dependent offsets (e.g. wind)
+    :param dc: Column offset (int)
+    :return: The shifted array
+    """
+
+    nrow, ncol = x.shape
+    cols = np.clip(np.arange(ncol) + dc, 0, ncol - 1)
+    if np.ndim(dr) == 0:
+        return x.take(np.clip(np.arange(nrow) + dr, 0, nrow - 1), axis=0).take(cols, axis=1)
+
+    # One shift per distinct offset
+    shifted = np.empty_like(x)
+    for d in np.unique(dr):
+        mask = dr == d
+        shifted[mask] = _shift(x, int(d), dc)[mask]
+    return shifted
+
+
+class GridMDP(object):
+    """
+    Stencil form of a gridworld's dynamics, for environments whose transitions are local moves on the grid.
+
+    Every action is a short list of outcomes (prob, dr, dc): with probability prob the agent moves by (dr, dc), clipped
+    to the grid. The reward only depends on the cell the agent lands in, and landing on a cliff sends the agent back to
+    the start. Bellman backups are then a handful of array shifts per action and memory is O(rows x cols): there is no
+    transition table at all. Exposes the same q_values/policy_backup/policy_system interface as CompiledMDP.
+    """
+
+    def __init__(self, desc, outcomes, landing_rewards):
+        """
+        :param desc: The map, a 2-D array of bytes
+        :param outcomes: For each action, a list of (prob, dr, dc) outcomes; dr may be an array shaped like desc
+        :param landing_rewards: Reward for moving into each cell, shaped like desc
+        """
+
+        self.desc = desc
+        self.shape = desc.shape
+        self.nS = desc.size
+        self.nA = len(outcomes)
+        self.outcomes = outcomes
+        self.landing_rewards = np.asarray(landing_rewards, dtype=np.float64)
+
+        flat_desc = desc.ravel()
+        self.isd = (flat_desc == b'S').astype(np.float64)
+        self.isd /= self.isd.sum()
+        self.start_state = int(np.argmax(flat_desc == b'S'))
+        self.terminal_states = (flat_desc == b'G') | (flat_desc == b'H')
+        self.cliff_states = flat_desc == b'C'
+        self._cliffs = self.cliff_states.reshape(self.shape)
+
+    @staticmethod
+    def frozen_lake(desc, step_prob=0.5, step_rew=-0.1, hole_rew=-1, goal_rew=1, rewarding=True, is_slippery=True):
+        """
+        Same dynamics as RewardingFrozenLakeEnv, for a map of any size.
+        """
+
+        desc = np.asarray(desc, dtype='c')
+        step_prob = min(step_prob, 1.0)
+        slip_prob = (1.0 - step_prob) / 2
+
+        outcomes = []
+        for a in range(4):
+            if is_slippery:
+                outcomes.append([(slip_prob,) + LAKE_MOVES[(a - 1) % 4], (step_prob,) + LAKE_MOVES[a],
+                                 (slip_prob,) + LAKE_MOVES[(a + 1) % 4]])
+            else:
+                outcomes.append([(1.0,) + LAKE_MOVES[a]])
+
+        landing_rewards = goal_rew * (desc == b'G').astype(np.float64)
+        if rewarding:
+            landing_rewards[(desc == b'F') | (desc == b'S')] = step_rew
+            landing_rewards[desc == b'H'] = hole_rew
+
+        return GridMDP(desc, outcomes, landing_rewards)
+
+    @staticmethod
+    def cliff_walking(desc, winds, wind_prob=0.1, step_rew=-1, fall_rew=-100, goal_rew=100):
+        """
+        Same dynamics as WindyCliffWalkingEnv, for a map of any size.
+
+        :param winds: How many rows the wind pushes the agent down from each cell, shaped like desc
+        """
+
+        desc = np.asarray(desc, dtype='c')
+        winds = np.asarray(winds, dtype=np.int64)
+
+        outcomes = [[(1 - wind_prob, dr, dc), (wind_prob, dr + winds, dc)] for dr, dc in CLIFF_MOVES]
+
+        landing_rewards = np.full(desc.shape, step_rew, dtype=np.float64)
+        landing_rewards[desc == b'G'] = goal_rew
+        landing_rewards[desc == b'C'] = fall_rew
+
+        return GridMDP(desc, outcomes, landing_rewards)
+
+    @staticmethod
+    def from_env(env):
+        """
+        Build the stencil form of a RewardingFrozenLakeEnv or WindyCliffWalkingEnv from its parameters (not from P).
+        """
+
+        env = env.unwrapped
+        if hasattr(env, 'wind_prob'):
+            return GridMDP.cliff_walking(env.desc, env.winds, wind_prob=env.wind_prob, step_rew=env.step_rew,
+                                         fall_rew=env.fall_rew, goal_rew=env.goal_rew)
+        return GridMDP.frozen_lake(env.desc, step_prob=env.step_prob, step_rew=env.step_reward,
+                                   hole_rew=env.hole_reward, goal_rew=env.goal_reward, rewarding=env.rewarding,
+                                   is_slippery=env.is_slippery)
+
+    def _landing_values(self, v):
+        # Value of moving into each cell: cliffs are worth what the start state is worth
+        landing = v.reshape(self.shape)
+        if self._cliffs.any():
+            landing = landing.copy()
+            landing[self._cliffs] = v[self.start_state]
+        return landing
+
+    def _expectations(self, landing):
+        # Expected landing quantity of every action, as an nA x rows x cols array
+        return np.stack([sum(prob * _shift(landing, dr, dc) for prob, dr, dc in action_outcomes)
+                         for action_outcomes in self.outcomes])
+
+    def _policy_expectation(self, policy, landing):
+        expectations = self._expectations(landing).reshape(self.nA, self.nS)
+        return np.einsum('sa,as->s', policy, expectations)
+
+    def q_values(self, v, discount_factor):
+        """
+        Expected value of every action in every state.
+
+        :param v: The value function, vector of length nS
+        :param discount_factor: Gamma discount factor
+        :return: An nS x nA matrix
+        """
+
+        landing = self.landing_rewards + discount_factor * self._landing_values(v)
+        return self._expectations(landing).reshape(self.nA, self.nS).T
+
+    def policy_backup(self, v, policy, discount_factor):
+        """
+        One full policy evaluation sweep over all states.
+
+        :param v: The current value function, vector of length nS
+        :param policy: The nS x nA policy to evaluate
+        :param discount_factor: Gamma discount factor
+        :return: The backed up value function
+        """
+
+        new_v = np.sum(policy * self.q_values(v, discount_factor), axis=1)
+        new_v[self.terminal_states] = 0
+        new_v[self.cliff_states] = new_v[self.start_state]
+        return new_v
+
+    def policy_system(self, policy, discount_factor):
+        """
+        The policy evaluation system A V = b (see CompiledMDP.policy_system), with A as a matrix-free LinearOperator.
+        Only the Krylov evaluation methods can solve it.
+
+        :param policy: The nS x nA policy to evaluate
+        :param discount_factor: Gamma discount factor
+        :return: A tuple (A, b)
+        """
+
+        special = self.terminal_states | self.cliff_states
+
+        def matvec(x):
+            x = np.ravel(x)
+            y = x - discount_factor * self._policy_expectation(policy, self._landing_values(x))
+            y[special] = x[special]
+            y[self.cliff_states] -= x[self.start_state]
+            return y
+
+        b = self._policy_expectation(policy, self.landing_rewards)
+        b[special] = 0
+
+        return linalg.LinearOperator((self.nS, self.nS), matvec=matvec, dtype=np.float64), b
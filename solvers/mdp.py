@@ -0,0 +1,171 @@
+import numpy as np
+
+from scipy import sparse
+
+
+class CompiledMDP(object):
+    """
+    Array ("compiled") form of a discrete environment's dynamics.
+
+    The transitions of every (state, action) pair are stored back to back in CSR layout: the transitions of pair
+    k = state * nA + action live in next_states/probs/rewards/dones[indptr[k]:indptr[k + 1]]. Solvers that are given a
+    CompiledMDP never walk the dict-based env.P.
+    """
+
+    def __init__(self, nS, nA, indptr, next_states, probs, rewards, dones, isd, desc=None):
+        self.nS = nS
+        self.nA = nA
+        self.indptr = indptr
+        self.next_states = next_states
+        self.probs = probs
+        self.rewards = rewards
+        self.dones = dones
+        self.isd = isd
+        self.desc = desc
+
+        # Expected immediate reward of each (state, action) pair
+        self.expected_rewards = np.add.reduceat(probs * rewards, indptr[:-1]).reshape(nS, nA)
+
+        # States the policy evaluator treats specially: goals/holes are worth nothing and cliffs are worth whatever
+        # the start state is worth (the agent is sent back there)
+        self.start_state = 0
+        self.terminal_states = np.zeros(nS, dtype=bool)
+        self.cliff_states = np.zeros(nS, dtype=bool)
+        if desc is not None:
+            flat_desc = desc.ravel()
+            self.start_state = int(np.argmax(flat_desc == b'S'))
+            self.terminal_states = (flat_desc == b'G') | (flat_desc == b'H')
+            self.cliff_states = flat_desc == b'C'
+
+        self._transition_matrix = None
+
+    @staticmethod
+    def from_env(env):
+        """
+        Build the compiled form of a discrete.DiscreteEnv, from its transition arrays if it has them or else by walking
+        its P once.
+
+        :param env: The environment (wrapped or unwrapped)
+        :return: A CompiledMDP
+        """
+
+        env = env.unwrapped
+        nS, nA = env.nS, env.nA
+
+        # Environments that build their transitions as dense nS x nA x K arrays already have the compiled form
+        if getattr(env, 'transitions', None) is not None:
+            next_states, probs, rewards, dones = env.transitions
+            K = next_states.shape[-1]
+            # (no copies when the arrays already have the right type, e.g. when memory-mapped from the MDP cache)
+            return CompiledMDP(nS, nA, np.arange(0, nS * nA * K + 1, K),
+                               np.ravel(next_states).astype(np.int64, copy=False),
+                               np.ravel(probs).astype(np.float64, copy=False),
+                               np.ravel(rewards).astype(np.float64, copy=False),
+                               np.ravel(dones).astype(bool, copy=False), np.asarray(env.isd, dtype=np.float64),
+                               desc=getattr(env, 'desc', None))
+
+        transitions = [env.P[s][a] for s in range(nS) for a in range(nA)]
+        indptr = np.zeros(nS * nA + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(t) for t in transitions])
+
+        flat = [t for ts in transitions for t in ts]
+        probs = np.array([t[0] for t in flat], dtype=np.float64)
+        next_states = np.array([t[1] for t in flat], dtype=np.int64)
+        rewards = np.array([t[2] for t in flat], dtype=np.float64)
+        dones = np.array([t[3] for t in flat], dtype=bool)
+
+        return CompiledMDP(nS, nA, indptr, next_states, probs, rewards, dones, np.asarray(env.isd, dtype=np.float64),
+                           desc=getattr(env, 'desc', None))
+
+    def transition_matrix(self):
+        """
+        The (nS * nA) x nS sparse matrix of transition probabilities; row state * nA + action holds P(. | s, a).
+        """
+
+        if self._transition_matrix is None:
+            self._transition_matrix = sparse.csr_matrix((self.probs, self.next_states, self.indptr),
+                                                        shape=(self.nS * self.nA, self.nS))
+        return self._transition_matrix
+
+    def lookahead(self, state, v, discount_factor):
+        """
+        Expected value of every action in a single state (the compiled equivalent of one_step_lookahead).
+
+        :param state: The state to consider
+        :param v: The value function, vector of length nS
+        :param discount_factor: Gamma discount factor
+        :return: A vector of length nA
+        """
+
+        lo = self.indptr[state * self.nA]
+        hi = self.indptr[(state + 1) * self.nA]
+        values = self.probs[lo:hi] * (self.rewards[lo:hi] + discount_factor * v[self.next_states[lo:hi]])
+        return np.add.reduceat(values, self.indptr[state * self.nA:(state + 1) * self.nA] - lo)
+
+    def q_values(self, v, discount_factor):
+        """
+        Expected value of every action in every state.
+
+        :param v: The value function, vector of length nS
+        :param discount_factor: Gamma discount factor
+        :return: An nS x nA matrix
+        """
+
+        return self.expected_rewards + discount_factor * self.transition_matrix().dot(v).reshape(self.nS, self.nA)
+
+    def policy_backup(self, v, policy, discount_factor):
+        """
+        One full policy evaluation sweep over all states.
+
+        :param v: The current value function, vector of length nS
+        :param policy: The nS x nA policy to evaluate
+        :param discount_factor: Gamma discount factor
+        :return: The backed up value function
+        """
+
+        new_v = np.sum(policy * self.q_values(v, discount_factor), axis=1)
+        new_v[self.terminal_states] = 0
+        new_v[self.cliff_states] = new_v[self.start_state]
+        return new_v
+
+    def policy_system(self, policy, discount_factor):
+        """
+        The linear system A V = b whose solution is the value of a policy, i.e. (I - gamma P_pi) V = r_pi with the
+        goal/hole rows replaced by V[s] = 0 and the cliff rows replaced by V[s] = V[start] (as in policy_backup).
+
+        :param policy: The nS x nA policy to evaluate
+        :param discount_factor: Gamma discount factor
+        :return: A tuple (A, b) with A a sparse CSR matrix
+        """
+
+        # P_pi = W T, where row s of W holds policy[s] in the columns of the pairs (s, 0) .. (s, nA - 1)
+        W = sparse.csr_matrix((policy.ravel(), np.arange(self.nS * self.nA),
+                               np.arange(0, self.nS * self.nA + 1, self.nA)), shape=(self.nS, self.nS * self.nA))
+        P_pi = W.dot(self.transition_matrix())
+        r_pi = np.sum(policy * self.expected_rewards, axis=1)
+
+        special = self.terminal_states | self.cliff_states
+        cliffs = np.flatnonzero(self.cliff_states)
+        A = sparse.diags((~special).astype(np.float64)).dot(sparse.identity(self.nS) - discount_factor * P_pi) \
+            + sparse.diags(special.astype(np.float64)) \
+            - sparse.csr_matrix((np.ones(len(cliffs)), (cliffs, np.full(len(cliffs), self.start_state))),
+                                shape=(self.nS, self.nS))
+        b = np.where(special, 0.0, r_pi)
+
+        return A.tocsr(), b
+
+
+def compile_mdp(env):
+    """
+    Compile an environment's dynamics, building them only once per environment instance.
+
+    :param env: The environment (wrapped or unwrapped)
+    :return: The environment's CompiledMDP
+    """
+
+    env = env.unwrapped
+    mdp = getattr(env, 'compiled_mdp', None)
+    if mdp is None:
+        mdp = CompiledMDP.from_env(env)
+        env.compiled_mdp = mdp
+    return mdp
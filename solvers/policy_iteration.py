@@ -2,45 +2,102 @@ import time
 
 import numpy as np
 from .base import BaseSolver, one_step_lookahead
+from .mdp import compile_mdp
 
 
 # Constants (default values unless provided by caller)
 DISCOUNT = 0.9
 THETA = 0.0001
+EVALUATION = 'iterative'
+WARM_START = True
+EVAL_SWEEPS = None
+ADAPTIVE_EVAL_RATIO = 0.1
 
 
 # Adapted from https://github.com/dennybritz/reinforcement-learning/blob/master/DP/Policy%20Iteration%20Solution.ipynb
 class PolicyIterationSolver(BaseSolver):
 
-    def __init__(self, env, discount_factor=DISCOUNT, max_policy_eval_steps=None, theta=THETA, verbose=False):
+    STATE = ('_policy', '_V', '_steps', '_last_delta', '_last_gain', '_step_times', '_policy_stable')
 
-        self._env = env.unwrapped
+    def __init__(self, env, discount_factor=DISCOUNT, max_policy_eval_steps=None, theta=THETA, verbose=False,
+                 mdp=None, evaluation=EVALUATION, warm_start=WARM_START, eval_sweeps=EVAL_SWEEPS):
+        """
+        :param warm_start: If true, each policy evaluation starts from the previous policy's value function
+        :param eval_sweeps: None to evaluate every policy fully (until theta). Otherwise modified policy iteration: an
+            int k runs at most k evaluation sweeps per improvement, and 'adaptive' sweeps until the values change by
+            less than ADAPTIVE_EVAL_RATIO times the gain of the last improvement (so a policy that barely changed
+            costs only a few sweeps). Modified PI always warm starts and runs on the compiled MDP.
+        """
 
-        self._policy = np.ones([self._env.nS, self._env.nA]) / self._env.nA
+        if eval_sweeps is not None and evaluation != 'iterative':
+            raise ValueError('eval_sweeps only applies to iterative policy evaluation')
+
+        # env may be None when mdp is a GridMDP built without an environment (e.g. for very large generated maps)
+        self._env = env.unwrapped if env is not None else None
+
+        # Solving the policy's linear system and modified PI need the compiled arrays
+        if (evaluation != 'iterative' or eval_sweeps is not None) and mdp is None:
+            mdp = compile_mdp(self._env)
+        model = mdp if mdp is not None else self._env
+        self._nS, self._nA = model.nS, model.nA
+
+        self._policy = np.ones([self._nS, self._nA]) / self._nA
+        self._V = np.zeros(self._nS)
         self._discount_factor = discount_factor
         self._steps = 0
         self._last_delta = 0
+        self._last_gain = 0
         self._step_times = []
         self._policy_stable = False
         self._max_policy_eval_steps = max_policy_eval_steps
         self._theta = theta
+        self._evaluation = evaluation
+        self._warm_start = warm_start or eval_sweeps is not None
+        self._eval_sweeps = eval_sweeps
 
-        super(PolicyIterationSolver, self).__init__(verbose)
+        super(PolicyIterationSolver, self).__init__(verbose, mdp)
 
     def step(self):
 
         start_time = time.clock()
+
+        max_eval_steps = self._max_policy_eval_steps
+        eval_theta = self._theta
+        if self._eval_sweeps == 'adaptive':
+            eval_theta = max(self._theta, ADAPTIVE_EVAL_RATIO * self._last_gain)
+        elif self._eval_sweeps is not None:
+            max_eval_steps = self._eval_sweeps
+
         # Evaluate the current policy
-        V = self.evaluate_policy(self._policy, discount_factor=self._discount_factor,
-                                 max_steps=self._max_policy_eval_steps, theta=self._theta)
+        previous_V = self._V
+        V = self.evaluate_policy(self._policy, discount_factor=self._discount_factor, max_steps=max_eval_steps,
+                                 theta=eval_theta, method=self._evaluation, V=self._V if self._warm_start else None)
+        self._V = V
 
         # Set to True if steps > 10, false otherwise; will be set to False if we make any changes to the policy
         self._policy_stable = self._steps > 10
 
+        if self._mdp is not None:
+            delta, reward = self._improve_policy_vectorized(V)
+        else:
+            delta, reward = self._improve_policy(V)
+
+        # Partially evaluated values can still be far off, so an unchanged policy alone does not mean convergence
+        if self._eval_sweeps is not None and np.max(np.abs(V - previous_V)) >= self._theta:
+            self._policy_stable = False
+
+        self._steps += 1
+        self._step_times.append(time.clock() - start_time)
+        self._last_delta = delta
+
+        return self._policy, V, self._steps, self._step_times[-1], reward, delta, self._policy_stable
+
+    def _improve_policy(self, V):
+
         delta = 0
         reward = 0  # float('-inf')
         # For each state...
-        for s in range(self._env.nS):
+        for s in range(self._nS):
             # The best action we would take under the current policy
             chosen_a = np.argmax(self._policy[s])
 
@@ -57,20 +114,43 @@ class PolicyIterationSolver(BaseSolver):
             # Greedily update the policy
             if chosen_a != best_a:
                 self._policy_stable = False
-            self._policy[s] = np.eye(self._env.nA)[best_a]
+            self._policy[s] = np.eye(self._nA)[best_a]
 
-        self._steps += 1
-        self._step_times.append(time.clock() - start_time)
-        self._last_delta = delta
+        return delta, reward
 
-        return self._policy, V, self._steps, self._step_times[-1], reward, delta, self._policy_stable
+    def _improve_policy_vectorized(self, V):
+
+        # Same greedy improvement as _improve_policy, for all states at once from the compiled MDP's Q matrix
+        action_values = self._mdp.q_values(V, self._discount_factor)
+        chosen_a = np.argmax(self._policy, axis=1)
+        best_a = np.argmax(action_values, axis=1)
+        best_action_values = action_values[np.arange(self._nS), best_a]
+
+        # Keep the current action when it ties with the best one; with exactly solved values, ties broken by rounding
+        # noise would otherwise make the policy flip back and forth forever
+        ties = action_values[np.arange(self._nS), chosen_a] >= best_action_values - 1e-10
+        best_a[ties] = chosen_a[ties]
+
+        # How much the improvement raised the one-step values, ignoring states the evaluator pins
+        gains = best_action_values - action_values[np.arange(self._nS), chosen_a]
+        gains[self._mdp.terminal_states | self._mdp.cliff_states] = 0
+        self._last_gain = np.max(gains)
+
+        if np.any(chosen_a != best_a):
+            self._policy_stable = False
+        self._policy[:] = 0
+        self._policy[np.arange(self._nS), best_a] = 1.0
+
+        return np.max(np.abs(best_action_values - V)), np.sum(best_action_values)
 
     def reset(self):
 
-        self._policy = np.ones([self._env.nS, self._env.nA]) / self._env.nA
+        self._policy = np.ones([self._nS, self._nA]) / self._nA
+        self._V = np.zeros(self._nS)
         self._steps = 0
         self._step_times = []
         self._last_delta = 0
+        self._last_gain = 0
         self._policy_stable = False
 
     def has_converged(self):
@@ -2,15 +2,69 @@ import time
 import numpy as np
 
 from .base import BaseSolver, one_step_lookahead, EpisodeStats
+from environments.vector import VectorEnv
+
+
+# Constants (default values unless provided by caller)
+KERNEL = 'fast'
+RANDOM_BLOCK_SIZE = 4096
+
+
+def initial_q(q_init, nS, nA, rng=None):
+    """
+    Initial Q table.
+
+    :param q_init: 'random' for small random values, or a constant
+    :param nS: Number of states
+    :param nA: Number of actions
+    :param rng: numpy Generator drawing the random values; defaults to np.random
+    :return: An nS x nA matrix
+    """
+
+    if q_init == 'random':
+        if rng is not None:
+            return rng.random((nS, nA))/1000.0
+        return np.random.rand(nS, nA)/1000.0
+    elif int(q_init) == 0:
+        return np.zeros(shape=(nS, nA))
+    return np.full((nS, nA), float(q_init))
 
 
 # Adapted from https://github.com/dennybritz/reinforcement-learning/blob/master/TD/Q-Learning%20Solution.ipynb
 class QLearningSolver(BaseSolver):
 
+    STATE = ('_Q', '_greedy', '_policy', '_V', '_random_block', '_random_index', '_rng', '_epsilon', '_steps',
+             '_step_times', '_last_delta', '_stats', '_consecutive_sub_theta_episodes')
+
     def __init__(self, env, max_episodes, min_episodes, max_steps_per_episode=500, discount_factor=1.0, alpha=0.5,
-                 epsilon=0.1, epsilon_decay=0.001, q_init=0, theta=0.0001, min_consecutive_sub_theta_episodes=10, verbose=False):
+                 epsilon=0.1, epsilon_decay=0.001, q_init=0, theta=0.0001, min_consecutive_sub_theta_episodes=10, verbose=False,
+                 kernel=KERNEL, rng=None):
+        """
+        :param kernel: 'fast' draws its randomness in blocks from rng, or 'compat' draws it one number at a time from
+            np.random and the environment exactly like the original env.step/np.random.choice loop, reproducing its
+            results seed for seed. Both learn with the same semantics.
+        :param rng: numpy Generator for the fast kernel's random initial Q values, starts, actions and transitions;
+            defaults to one seeded from np.random
+        """
+
+        if kernel not in ('fast', 'compat'):
+            raise ValueError('Unknown Q-learning kernel: {}'.format(kernel))
+        if kernel == 'compat' and rng is not None:
+            raise ValueError('The compat kernel draws from np.random; it does not take an rng')
 
         self._env = env.unwrapped
+        self._kernel = kernel
+        self._rng = None
+        if kernel == 'fast':
+            self._rng = rng if rng is not None else np.random.default_rng(np.random.randint(0, 2 ** 31 - 1))
+
+        # Transitions as nested lists of cumulative probabilities and outcomes, for cheap scalar access
+        vector_env = VectorEnv(self._env)
+        self._cum_probs = vector_env.cum_probs.tolist()
+        self._cum_isd = vector_env.cum_isd
+        self._next_states = vector_env.next_states.tolist()
+        self._rewards = vector_env.rewards.tolist()
+        self._dones = vector_env.dones.tolist()
 
         self._max_episodes = max_episodes
         self._min_episodes = min_episodes
@@ -39,53 +93,144 @@ class QLearningSolver(BaseSolver):
 
         start_time = time.clock()
 
-        # Reset the environment and pick the first action
-        state = self._env.reset()
+        if self._kernel == 'compat':
+            total_reward, episode_steps, td_delta = self._run_episode(np.random.random_sample,
+                                                                      self._env.np_random.rand, compat=True)
+        else:
+            total_reward, episode_steps, td_delta = self._run_episode(self._next_random, self._next_random)
+
+        # Episode statistics are only written once the episode is over
+        self._stats.episode_rewards[self._steps] += total_reward
+        self._stats.episode_lengths[self._steps] = episode_steps - 1
+        self._stats.episode_times[self._steps] = time.clock() - start_time
+        self._stats.episode_deltas[self._steps] = td_delta
+
+        if self._last_delta < self._theta:
+            self._consecutive_sub_theta_episodes += 1
+        else:
+            self._consecutive_sub_theta_episodes = 0
+
+        self._step_times.append(time.clock() - start_time)
+
+        self._steps += 1
+
+        # The policy and value are handed out as read-only views, not copies: an episode only costs the states it
+        # touched, and whoever keeps them (see ExperimentStats) copies what it keeps
+        return self._read_only(self._policy), self._read_only(self._V), self._steps, self._step_times[-1], \
+            total_reward/episode_steps, self._last_delta, self.has_converged()
+
+    def _run_episode(self, action_random, env_random, compat=False):
+        """
+        Run one episode of epsilon-greedy Q-learning.
+
+        :param action_random: Function returning the uniform number that picks each action
+        :param env_random: Function returning the uniform number that samples each transition
+        :param compat: If true, pick actions exactly as np.random.choice does (same floating point cumulative
+            probabilities), instead of the equivalent but cheaper threshold on epsilon
+        :return: A tuple (total reward, steps taken, last TD delta)
+        """
+
+        Q = self._Q
+        greedy = self._greedy
+        nA = self._env.nA
+        alpha = self._alpha
+        discount_factor = self._discount_factor
+        epsilon_decay = self._epsilon_decay
+        epsilon = self._epsilon
+        cum_probs, next_states, rewards, dones = self._cum_probs, self._next_states, self._rewards, self._dones
+
+        if compat:
+            state = self._env.reset()
+        else:
+            state = int(np.searchsorted(self._cum_isd, action_random(), side='right'))
 
-        # One step in the environment
         total_reward = 0.0
         episode_steps = 0
+        td_delta = 0.0
+        touched = set()
         for t in range(self._max_steps_per_episode+1):
-            # Take a step
-            action_probs = self._policy_function(state)
-            action = np.random.choice(np.arange(len(action_probs)), p=action_probs)
-            next_state, reward, done, _ = self._env.step(action)
-
-            # Update statistics
-            self._stats.episode_rewards[self._steps] += reward
-            self._stats.episode_lengths[self._steps] = t
-            self._stats.episode_times[self._steps] = time.clock() - start_time
+            # Pick an epsilon-greedy action
+            best_action = greedy[state]
+            u = action_random()
+            if compat:
+                explore = epsilon / nA
+                cdf = 0.0
+                cdfs = []
+                for a in range(nA):
+                    cdf += explore + (1.0 - epsilon) if a == best_action else explore
+                    cdfs.append(cdf)
+                action = 0
+                while action < nA - 1 and cdfs[action] / cdf <= u:
+                    action += 1
+            elif u < epsilon:
+                action = min(int(u / epsilon * nA), nA - 1)
+            else:
+                action = best_action
+
+            # Take a step (first outcome whose cumulative probability exceeds u, as gym's categorical_sample)
+            outcome_probs = cum_probs[state][action]
+            u = env_random()
+            k = 0
+            while k < len(outcome_probs) and outcome_probs[k] <= u:
+                k += 1
+            if k == len(outcome_probs):
+                k = 0
+            next_state = next_states[state][action][k]
+            reward = rewards[state][action][k]
 
             # TD Update
-            best_next_action = np.argmax(self._Q[next_state])
-            td_target = reward + self._discount_factor * self._Q[next_state, best_next_action]
-            td_delta = td_target - self._Q[state, action]
-            self._stats.episode_deltas[self._steps] = td_delta
-            self._Q[state, action] += self._alpha * td_delta
+            q = Q.item(state, action)
+            td_delta = reward + discount_factor * Q.item(next_state, greedy[next_state]) - q
+            q += alpha * td_delta
+            Q.itemset((state, action), q)
+            touched.add(state)
+
+            # Keep the greedy action of the updated state current (first maximum on ties, as np.argmax)
+            best_q = Q.item(state, best_action)
+            if action == best_action:
+                if td_delta < 0:
+                    greedy[state] = int(np.argmax(Q[state]))
+            elif q > best_q or (q == best_q and action < best_action):
+                greedy[state] = action
 
             # Decay epsilon
-            self._epsilon -= self._epsilon * self._epsilon_decay
+            epsilon -= epsilon * epsilon_decay
 
             total_reward += reward
-            self._last_delta = abs(self._alpha * td_delta)
-
             episode_steps += 1
-            if done:
+            if dones[state][action][k]:
                 break
 
             state = next_state
 
-        if self._last_delta < self._theta:
-            self._consecutive_sub_theta_episodes += 1
-        else:
-            self._consecutive_sub_theta_episodes = 0
+        self._epsilon = epsilon
+        self._last_delta = abs(alpha * td_delta)
+        self._update_greedy(list(touched))
 
-        self._step_times.append(time.clock() - start_time)
+        return total_reward, episode_steps, td_delta
 
-        self._steps += 1
+    @staticmethod
+    def _read_only(array):
+        view = array.view()
+        view.flags.writeable = False
+        return view
 
-        return self.get_policy(), self.get_value(), self._steps, self._step_times[-1], \
-            total_reward/episode_steps, self._last_delta, self.has_converged()
+    def _update_greedy(self, states):
+
+        # Bring the greedy policy and value of the given states up to date with their greedy actions
+        actions = [self._greedy[s] for s in states]
+        self._policy[states] = 0.0
+        self._policy[states, actions] = 1.0
+        self._V[states] = self._Q[states, actions]
+
+    def _next_random(self):
+
+        # Uniform random numbers are drawn in blocks; this hands them out one at a time
+        if self._random_index == len(self._random_block):
+            self._random_block = self._rng.random(RANDOM_BLOCK_SIZE).tolist()
+            self._random_index = 0
+        self._random_index += 1
+        return self._random_block[self._random_index - 1]
 
     def reset(self):
 
@@ -116,35 +261,45 @@ class QLearningSolver(BaseSolver):
     def get_stats(self):
         return self._stats
 
+    def get_state(self):
+        state = super(QLearningSolver, self).get_state()
+
+        # The compat kernel draws from np.random and the environment
+        if self._kernel == 'compat':
+            state['np_random'] = np.random.get_state()
+            state['env_random'] = self._env.np_random.get_state()
+        return state
+
+    def set_state(self, state):
+        state = dict(state)
+        if 'np_random' in state:
+            np.random.set_state(state.pop('np_random'))
+            self._env.np_random.set_state(state.pop('env_random'))
+        super(QLearningSolver, self).set_state(state)
+
     def get_q(self):
         return self._Q
 
     def get_policy(self):
 
-        policy = np.zeros([self._env.nS, self._env.nA])
-        for s in range(self._env.nS):
-            best_action = np.argmax(self._Q[s])
-            # Always take the best action
-            policy[s, best_action] = 1.0
-
-        return policy
+        # The greedy policy is kept up to date as episodes update Q; hand out a snapshot
+        return self._policy.copy()
 
     def get_value(self):
 
-        v = np.zeros(self._env.nS)
-        for s in range(self._env.nS):
-            v[s] = np.max(self._Q[s])
-
-        return v
+        return self._V.copy()
 
     def _init_q(self):
 
-        if self._q_init == 'random':
-            self._Q = np.random.rand(self._env.observation_space.n, self._env.action_space.n)/1000.0
-        elif int(self._q_init) == 0:
-            self._Q = np.zeros(shape=(self._env.observation_space.n, self._env.action_space.n))
-        else:
-            self._Q = np.full((self._env.observation_space.n, self._env.action_space.n), float(self._q_init))
+        self._Q = initial_q(self._q_init, self._env.observation_space.n, self._env.action_space.n, rng=self._rng)
+        self._greedy = np.argmax(self._Q, axis=1).tolist()
+        self._policy = np.zeros(self._Q.shape)
+        self._V = np.zeros(self._Q.shape[0])
+        self._update_greedy(list(range(self._Q.shape[0])))
+
+        # The fast kernel's buffer of uniform random numbers
+        self._random_block = []
+        self._random_index = 0
 
     def _policy_function(self, observation):
 
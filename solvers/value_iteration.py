@@ -2,6 +2,8 @@ import time
 import numpy as np
 
 from .base import BaseSolver, one_step_lookahead
+from .grid import GridMDP
+from .mdp import compile_mdp
 
 
 # Constants (default values unless provided by caller)
@@ -12,32 +14,53 @@ THETA = 0.0001
 # Adapted from https://github.com/dennybritz/reinforcement-learning/blob/master/DP/Value%20Iteration%20Solution.ipynb
 class ValueIterationSolver(BaseSolver):
 
+    STATE = ('_V', '_policy', '_steps', '_last_delta', '_step_times')
+
     # Originally 0.0001, not 0.00001
-    def __init__(self, env, discount_factor=DISCOUNT, theta=THETA, verbose=False):
+    def __init__(self, env, discount_factor=DISCOUNT, theta=THETA, verbose=False, mdp=None, vectorized=False):
+        """
+        :param vectorized: If true, each step backs up every state at once from the previous step's values
+            (synchronous, Jacobi) on the compiled arrays, instead of sweeping the states in order and updating V in
+            place (Gauss-Seidel). A step is much cheaper, but it takes more steps to converge and the per-step values
+            and deltas differ from the in-place sweep's
+        """
+
 
-        self._env = env.unwrapped
+        # env may be None when mdp is a GridMDP built without an environment (e.g. for very large generated maps)
+        self._env = env.unwrapped if env is not None else None
 
-        self._V = np.zeros(self._env.nS)
+        # The vectorized backend needs the compiled arrays; a GridMDP only has a vectorized form
+        self._vectorized = vectorized or isinstance(mdp, GridMDP)
+        if self._vectorized and mdp is None:
+            mdp = compile_mdp(self._env)
+        model = mdp if mdp is not None else self._env
+        self._nS, self._nA = model.nS, model.nA
 
-        self._policy = np.zeros([self._env.nS, self._env.nA])
+        self._V = np.zeros(self._nS)
+
+        self._policy = np.zeros([self._nS, self._nA])
         self._discount_factor = discount_factor
         self._theta = theta
         self._steps = 0
         self._last_delta = theta
         self._step_times = []
 
-        super(ValueIterationSolver, self).__init__(verbose)
+        super(ValueIterationSolver, self).__init__(verbose, mdp)
 
     def step(self):
 
+        if self._vectorized:
+            return self._vectorized_step()
+
         start_time = time.clock()
+        model = self._mdp if self._mdp is not None else self._env
 
         delta = 0
         reward = 0
         # Update each state...
-        for s in range(self._env.nS):
+        for s in range(self._nS):
             # Do a one-step lookahead to find the best action
-            A = one_step_lookahead(self._env, self._discount_factor, s, self._V)
+            A = one_step_lookahead(model, self._discount_factor, s, self._V)
 
             best_action_value = np.max(A)
             # Calculate delta across all states seen so far
@@ -53,20 +76,45 @@ class ValueIterationSolver(BaseSolver):
         self._steps += 1
 
         # Create a deterministic policy using the optimal value function
-        self._policy = np.zeros([self._env.nS, self._env.nA])
-        for s in range(self._env.nS):
+        self._policy = np.zeros([self._nS, self._nA])
+        for s in range(self._nS):
             # One step lookahead to find the best action for this state
-            A = one_step_lookahead(self._env, self._discount_factor, s, self._V)
+            A = one_step_lookahead(model, self._discount_factor, s, self._V)
             best_action = np.argmax(A)
             # Always take the best action
             self._policy[s, best_action] = 1.0
 
         return self._policy, self._V, self._steps, self._step_times[-1], reward, delta, self.has_converged()
 
+    def _vectorized_step(self):
+        """
+        A full sweep done as one sparse mat-vec: V, delta, reward and the greedy policy all come from the same Q matrix.
+        Every state is backed up from the previous sweep's values rather than in place.
+        """
+
+        start_time = time.clock()
+
+        Q = self._mdp.q_values(self._V, self._discount_factor)
+        best_actions = np.argmax(Q, axis=1)
+        V = Q[np.arange(self._nS), best_actions]
+
+        delta = np.max(np.abs(V - self._V))
+        reward = np.sum(V)
+        self._V = V
+        self._step_times.append(time.clock() - start_time)
+
+        self._last_delta = delta
+        self._steps += 1
+
+        self._policy = np.zeros([self._nS, self._nA])
+        self._policy[np.arange(self._nS), best_actions] = 1.0
+
+        return self._policy, self._V, self._steps, self._step_times[-1], reward, delta, self.has_converged()
+
     def reset(self):
 
-        self._V = np.zeros(self._env.nS)
-        self._policy = np.zeros([self._env.nS, self._env.nA])
+        self._V = np.zeros(self._nS)
+        self._policy = np.zeros([self._nS, self._nA])
         self._steps = 0
         self._step_times = []
         self._last_delta = 0
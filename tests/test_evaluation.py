@@ -0,0 +1,58 @@
+import numpy as np
+
+import solvers
+from environments.frozen_lake import RewardingFrozenLakeEnv
+from solvers.evaluation import exact_policy_evaluation
+
+
+# Steps of the finite horizon recursion the absorbing chain is checked against
+MAX_STEPS = 100000
+
+LEFT, DOWN, RIGHT, UP = range(4)
+
+
+def policy(nS, actions, default=LEFT):
+    chosen = np.full(nS, default)
+    for state, action in actions.items():
+        chosen[state] = action
+    return np.eye(4)[chosen]
+
+
+def test_matches_finite_horizon():
+    env = RewardingFrozenLakeEnv(map_name='8x8', step_prob=0.8)
+    mdp = solvers.compile_mdp(env)
+    p = np.eye(4)[np.random.default_rng(0).integers(0, 4, mdp.nS)]
+
+    exact = exact_policy_evaluation(mdp, p)
+    finite = exact_policy_evaluation(mdp, p, MAX_STEPS)
+    assert np.isclose(exact.expected_return, finite.expected_return)
+    assert np.isclose(exact.expected_length, finite.expected_length)
+    for kind, probability in exact.absorption.items():
+        assert np.isclose(probability, finite.absorption[kind])
+
+
+def test_episodes_that_may_run_forever():
+    # From S, slips can lead into the left column, where the policy walks into the wall forever
+    env = RewardingFrozenLakeEnv(desc=['FSG', 'FFF', 'FFF'], step_prob=0.8)
+    mdp = solvers.compile_mdp(env)
+    p = policy(mdp.nS, {1: RIGHT})
+
+    exact = exact_policy_evaluation(mdp, p)
+    finite = exact_policy_evaluation(mdp, p, MAX_STEPS)
+    assert np.isnan(exact.expected_return)
+    assert np.isinf(exact.expected_length)
+    assert np.isclose(exact.absorption['G'], finite.absorption['G'])
+    assert np.isclose(exact.absorption['running'], finite.absorption['running'])
+    assert exact.absorption['running'] > 0
+
+
+def test_deterministic_loop():
+    # Certain steps have zero probability slips, which are not transitions: S and its right neighbour swap forever
+    env = RewardingFrozenLakeEnv(map_name='4x4', step_prob=1.0)
+    mdp = solvers.compile_mdp(env)
+    p = policy(mdp.nS, {0: RIGHT, 1: LEFT}, default=DOWN)
+
+    exact = exact_policy_evaluation(mdp, p)
+    assert np.isnan(exact.expected_return)
+    assert np.isinf(exact.expected_length)
+    assert exact.absorption['running'] == 1.0